@@ -30,6 +30,10 @@ class App extends React.Component {
             mathTotal: 0,
             totalRows: null,
             readyToPlot: false,
+            // While the file is still loading: {rowsLoaded, totalRows} of the rows that can be plotted.
+            partialLoad: null,
+            // Bumped when a partially loaded file finishes, so the plots are redrawn with all the rows.
+            dataVersion: 0,
             knownSessions: [],
             initState: null,
             knownSessionsLoaded: false,
@@ -135,7 +139,10 @@ class App extends React.Component {
 
         const data = new FormData();
         data.append('file', this.uploadInput.files[0]);
-        if (this.uploadInput.files[0].type == "text/csv") {
+        // Compressed CSVs, Parquet and Arrow files don't have a useful MIME type, so go by the extension.
+        const name = this.uploadInput.files[0].name.toLowerCase()
+        const extensions = ['.csv', '.gz', '.bz2', '.xz', '.zst', '.h5ad', '.parquet', '.pq', '.feather', '.arrow', '.ipc']
+        if (this.uploadInput.files[0].type == "text/csv" || extensions.some((ext) => name.endsWith(ext))) {
             this.doUpload(data, this.uploadInput.files[0].name);
         } else {
             this.toastError("Wrong File type");
@@ -237,81 +244,104 @@ class App extends React.Component {
     }
 
     getLoadProgress() {
-        if (this.state.isCloud && this.state.cloudDateEnded == null) {
-            fetch("api/cloud_progress?data_id=" + this.state.dataId)
-                .then(res => res.json())
-                .then(
-                    (result) => {
-                        if ('error' in result) {
-                            this.toastError(result['error']);
-                            setTimeout(this.getLoadProgress, 250);
-                            return;
-                        }
-                        if (this.state.cloudDateStarted == null) {
-                            this.setState({
-                                cloudDateStarted: Date.now(),
-                                showUploadBar: true,
-                            });
-                        }
-                        const progress = result['progress']
-                        if (result['progress'] == 1) {
-                            this.setState({
-                                cloudDateEnded: Date.now(),
-                                cloudLoaded: result['total_bytes'],
-                                cloudTotal: result['total_bytes'],
-                                cloudProgress: progress,
-                                cloudInCache: result['in_cache'],
-                            });
-                        } else {
-                            this.setState({
-                                cloudLoaded: result['downloaded_bytes'],
-                                cloudTotal: result['total_bytes'],
-                                cloudProgress: progress,
-                                cloudInCache: result['in_cache'],
-                            });
-                        }
-                        setTimeout(this.getLoadProgress, 250);
-                    }
-                )
-        } else {
-            fetch("api/processing_progress?data_id=" + this.state.dataId)
-                .then(res => res.json())
-                .then(
-                    (result) => {
-                        if ('error' in result) {
-                            this.toastError(result['error'])
-                            setTimeout(this.getLoadProgress, 250);
-                            return
-                        }
-                        if (this.state.processingDateStarted == null) {
-                            this.setState({
-                                processingDateStarted: Date.now()
-                            })
-                        }
-                        const progress = result['progress']
-                        if (result['done']) {
-                            this.setState({
-                                loadingProgress: progress,
-                                readyToPlot: true
-                            })
-                        } else {
-                            const rowsLoaded = result['rows_loaded']
-                            const totalRows = result['total_rows']
-                            const mathDone = result['math_vars_loaded']
-                            const mathTotal = result['math_vars_total']
-                            this.setState({
-                                loadingProgress: progress,
-                                totalRows: totalRows,
-                                rowsLoaded: rowsLoaded,
-                                mathDone: mathDone,
-                                mathTotal: mathTotal,
-                                loadingText: result['text'],
-                            })
-                            setTimeout(this.getLoadProgress, 250);
-                        }
-                    }
-                )
-        }
+        // The server sends progress as it changes: "cloud" events while a Google Drive file downloads,
+        // then "loading" events until the data is ready, then "follow" events as rows are appended to a
+        // followed file.  Each response ends right away and the EventSource reconnects for more.
+        const source = new EventSource("api/progress_stream?data_id=" + this.state.dataId)
+
+        source.addEventListener('cloud', (e) => {
+            const result = JSON.parse(e.data)
+            if (!this.state.isCloud || this.state.cloudDateEnded != null) {
+                return
+            }
+            if ('error' in result) {
+                this.toastError(result['error']);
+                return;
+            }
+            if (this.state.cloudDateStarted == null) {
+                this.setState({
+                    cloudDateStarted: Date.now(),
+                    showUploadBar: true,
+                });
+            }
+            const progress = result['progress']
+            if (result['progress'] == 1) {
+                this.setState({
+                    cloudDateEnded: Date.now(),
+                    cloudLoaded: result['total_bytes'],
+                    cloudTotal: result['total_bytes'],
+                    cloudProgress: progress,
+                    cloudInCache: result['in_cache'],
+                });
+            } else {
+                this.setState({
+                    cloudLoaded: result['downloaded_bytes'],
+                    cloudTotal: result['total_bytes'],
+                    cloudProgress: progress,
+                    cloudInCache: result['in_cache'],
+                });
+            }
+        })
+
+        source.addEventListener('loading', (e) => {
+            const result = JSON.parse(e.data)
+            if ('error' in result) {
+                this.toastError(result['error'])
+                source.close()
+                return
+            }
+            if (this.state.processingDateStarted == null) {
+                this.setState({
+                    processingDateStarted: Date.now()
+                })
+            }
+            const progress = result['progress']
+            if (result['done']) {
+                if (!result['following']) {
+                    source.close()
+                }
+                this.setState({
+                    loadingProgress: progress,
+                    readyToPlot: true,
+                    partialLoad: null,
+                    dataVersion: this.state.partialLoad == null ? this.state.dataVersion : this.state.dataVersion + 1,
+                })
+            } else {
+                const rowsLoaded = result['rows_loaded']
+                const totalRows = result['total_rows']
+                const mathDone = result['math_vars_loaded']
+                const mathTotal = result['math_vars_total']
+                this.setState({
+                    loadingProgress: progress,
+                    totalRows: totalRows,
+                    rowsLoaded: rowsLoaded,
+                    mathDone: mathDone,
+                    mathTotal: mathTotal,
+                    loadingText: result['text'],
+                })
+                if (result['partial']) {
+                    // The rows read so far can be plotted while the rest load.
+                    this.setState({
+                        readyToPlot: true,
+                        partialLoad: { rowsLoaded: rowsLoaded, totalRows: totalRows },
+                    })
+                }
+            }
+        })
+
+        source.addEventListener('follow', (e) => {
+            const result = JSON.parse(e.data)
+            if (result['stopped']) {
+                source.close()
+                return
+            }
+            // New rows were appended to the file: replot with them.
+            this.setState({
+                totalRows: result['rows'],
+                rowsLoaded: result['rows'],
+                dataVersion: this.state.dataVersion + 1,
+            })
+        })
     }
 
     resumeSession(session) {
@@ -393,15 +423,15 @@ class App extends React.Component {
         return this.useFile(filename, file_size, false)
     }
 
-    useExternalFile(filename, file_size) {
-        return this.useFile(filename, file_size, false, null, true)
+    useExternalFile(filename, file_size, follow = false) {
+        return this.useFile(filename, file_size, false, null, true, follow)
     }
 
     useCloudFile(filedata) {
         return this.useFile(filedata['name'], filedata['size'], true, filedata['id'])
     }
 
-    useFile(filename, file_size, isCloud, cloudId = null, isExternal = false) {
+    useFile(filename, file_size, isCloud, cloudId = null, isExternal = false, follow = false) {
         let url = ''
         if (isCloud) {
             url = 'api/load_cloud_file'
@@ -416,6 +446,7 @@ class App extends React.Component {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 filename: request_name,
+                follow: follow,
             })
         }
         fetch(url, requestOptions)
@@ -553,7 +584,8 @@ class App extends React.Component {
                         shiftPressed={this.state.shiftPressed}
                         controlPressed={this.state.controlPressed}
                         backendConfig={this.state.backendConfig}
-
+                        partialLoad={this.state.partialLoad}
+                        dataVersion={this.state.dataVersion}
                     />
                 </ErrorBoundary>
             </div>)
@@ -719,10 +751,10 @@ class App extends React.Component {
                         <div style={{ display: notUploadDisp }}>
                             <div style={{ display: 'flex' }}>
                                 <div style={{ marginLeft: '20px', marginRight: '20px', width: '50%' }}>
-                                    <h4 className="display-6 ">Upload a .csv or .h5ad</h4>
+                                    <h4 className="display-6 ">Upload a .csv, .parquet, .feather or .h5ad</h4>
                                     <div className="mx-auto">
                                         <Form className='d-flex' style={{ marginBottom: '5px', marginTop: '20px' }}>
-                                            <Form.Control accept="text/csv, .h5ad" type="file" ref={(ref) => { this.uploadInput = ref; }} />
+                                            <Form.Control accept="text/csv, .gz, .bz2, .xz, .zst, .h5ad, .parquet, .pq, .feather, .arrow, .ipc" type="file" ref={(ref) => { this.uploadInput = ref; }} />
                                             <Button style={{ marginLeft: '5px' }} onClick={this.handleUpload}>Upload</Button>
                                         </Form>
                                         <p></p>
@@ -874,9 +906,10 @@ class App extends React.Component {
                     this.resumeSession(session)
                 }
             } else if (loc[loc.length - 1] == 'load_file') {
-                const filename = new URLSearchParams(window.location.search).get('filename')
+                const params = new URLSearchParams(window.location.search)
+                const filename = params.get('filename')
                 if (filename !== null && filename.length > 0) {
-                    this.useExternalFile(filename, 0)
+                    this.useExternalFile(filename, 0, params.get('follow') == 'true')
                 }
             }
         }
@@ -53,7 +53,7 @@ export const FileDropBox = (props) => {
     return (<div ref={drop} role={'DropArea'} style={{ ...style, backgroundColor, borderWidth, color, borderColor }}>
         <div style={{ display: 'grid', width: '100%', height: '100%' }}>
             <p style={{ margin: 'auto', writingMode: props.writingMode, transform: props.transform, textDecoration }} >
-                Drop a <span style={{fontFamily: 'monospace'}}>.csv</span> or <span style={{fontFamily: 'monospace'}}>.h5ad</span> file
+                Drop a <span style={{fontFamily: 'monospace'}}>.csv</span>, <span style={{fontFamily: 'monospace'}}>.parquet</span>, <span style={{fontFamily: 'monospace'}}>.feather</span> or <span style={{fontFamily: 'monospace'}}>.h5ad</span> file
             </p>
         </div>
     </div>);
@@ -167,6 +167,10 @@ export default class FilterDialog extends React.Component {
                         })
                         return
                     }
+                    if ('preempt' in result) {
+                        // The same import was sent again, the newer request adds the subsets.
+                        return
+                    }
 
                     this.processMultiSubsetCreationResponse(result)
                 }
@@ -315,6 +319,10 @@ export default class FilterDialog extends React.Component {
                         })
                         return
                     }
+                    if ('preempt' in result) {
+                        // A newer request for the same strings replaced this one.
+                        return
+                    }
 
                     // If the number of unique strings is less than 100, show the checkboxes.
                     const numUnique = result['num_unique']
@@ -450,6 +458,10 @@ export default class FilterDialog extends React.Component {
                             this.props.toastError(result['error'])
                             return;
                         }
+                        if ('preempt' in result) {
+                            // A newer filter request replaced this one.
+                            return;
+                        }
                         if (createMultipleSubsets) {
                             return this.processMultiSubsetCreationResponse(result)
                         }
@@ -872,6 +884,9 @@ export default class FilterDialog extends React.Component {
                             showSpinnerOnFilterButton: false,
                         })
                         return
+                    } else if ('preempt' in result) {
+                        // A newer request replaced this one.
+                        return
                     } else {
                         if ('new_subset_id' in result) {
                             this.setState({
@@ -1,5 +1,5 @@
 import React from 'react';
-import { Container, Row, Col, Form, ToastContainer, Toast, Card, Button, DropdownButton, Dropdown, Collapse, Badge } from 'react-bootstrap';
+import { Container, Row, Col, Form, ToastContainer, Toast, Card, Button, DropdownButton, Dropdown, Collapse, Badge, Alert, Spinner } from 'react-bootstrap';
 import { DndProvider } from 'react-dnd'
 import { Split } from '@geoffcox/react-splitter';
 import { HTML5Backend } from 'react-dnd-html5-backend'
@@ -359,6 +359,10 @@ class Plotplot extends React.Component {
                     this.toastError(result['error']);
                     return;
                 }
+                if ('preempt' in result) {
+                    // A newer request for the same correlation replaced this one.
+                    return;
+                }
                 Object.assign(plotStates[plotId], { correlations: result, corrUpdatePending: false });
                 this.setState({
                     plotStates: plotStates
@@ -612,7 +616,20 @@ class Plotplot extends React.Component {
     }
 
 
-    componentDidUpdate() {
+    componentDidUpdate(prevProps) {
+        if (prevProps.dataVersion != this.props.dataVersion) {
+            // The file finished loading, redraw the plots that were made with part of it.
+            let newPlotstates = this.state.plotStates
+            for (let i = 0; i < newPlotstates.length; i++) {
+                if (newPlotstates[i].graphJson != null) {
+                    newPlotstates[i].forceUpdateNow = true
+                }
+            }
+            this.setState({
+                plotStates: newPlotstates
+            })
+        }
+
         // let s = ''
         // for (let p of this.state.plotStates) {
         //     s += p.key + ' ' 
@@ -809,6 +826,13 @@ class Plotplot extends React.Component {
                                         v. {preval`module.exports = new Date().toLocaleString();`}
                                     </div>
                                 </div>
+                                {this.props.partialLoad != null &&
+                                    <Alert variant="info" style={{ width: '98%', margin: '5px', padding: '8px' }}>
+                                        <Spinner animation="border" size="sm" style={{ marginRight: '8px' }} />
+                                        Still loading: plots show the first {(this.props.partialLoad.rowsLoaded || 0).toLocaleString()} of
+                                        ~{(this.props.partialLoad.totalRows || 0).toLocaleString()} rows.  New subsets and math wait until it has finished.
+                                    </Alert>
+                                }
                                 <Card style={{ width: '98%', margin: '5px' }}>
                                     <Card.Header style={{ backgroundColor: '#e7f1ff', color: '#0c63e4' }}>Subsets</Card.Header>
                                     <Card.Body style={{ padding: '8px', paddingLeft: '11px', margin: '5px' }}>
@@ -826,6 +850,7 @@ class Plotplot extends React.Component {
                                             setSubsetOrder={this.setSubsetOrder}
                                             subsetOrder={this.state.subsetOrder}
                                             lastSubsetChange={this.state.lastSubsetChange}
+                                            dataVersion={this.props.dataVersion}
                                         />
                                     </Card.Body>
                                 </Card>
@@ -847,6 +872,7 @@ class Plotplot extends React.Component {
                                             updateHoverlist={this.updateHoverlist}
                                             hoverlistNumeric={this.state.hoverlistNumeric}
                                             hoverlistNonNumeric={this.state.hoverlistNonNumeric}
+                                            dataVersion={this.props.dataVersion}
                                         />
                                     </Card.Body>
                                 </Card>
@@ -22,7 +22,7 @@ export const SubsetList = ((props) => {
     const [subsetOrderLocal, setSubsetOrderLocal] = useState(props.initSubsetOrder) // local version of subset order, used during drag/move to avoid rerendering tons of plots
 
     useEffect(() => {
-        // Initial load of subsets
+        // Load the subsets, and again when a file that was plotted while loading has finished.
         fetch("api/" + props.dataId + "/subsets")
             .then(res => res.json())
             .then(
@@ -35,7 +35,7 @@ export const SubsetList = ((props) => {
                     setIsLoaded(true)
                 }
             )
-    }, []);
+    }, [props.dataVersion]);
 
     const moveCard = useCallback((dragIndex, hoverIndex) => {
         setSubsetOrderLocal(
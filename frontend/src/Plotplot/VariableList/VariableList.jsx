@@ -21,7 +21,7 @@ function VariableList(props) {
                     setIsLoaded(true)
                 }
             )
-    }, []);
+    }, [props.dataVersion]);
 
     const allcols = useMemo(() => {
         console.log('Loading variable list...');
@@ -0,0 +1,111 @@
+import os
+import threading
+import contextlib
+from collections import OrderedDict, deque
+from flask import has_request_context, request
+from flask_login import current_user
+from . import plotplot_config
+
+# Created on first use so the config file is read after the server has set it up.
+g_admission_controller = None
+g_admission_controller_lock = threading.Lock()
+
+# Environment variables read by the threaded math libraries when they start up.
+thread_budget_env_vars = [
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+]
+
+
+def get_max_heavy_requests():
+    default = max(2, os.cpu_count() // 4)
+    return max(1, plotplot_config.get_int_with_default('performance', 'max_heavy_requests', default))
+
+
+def get_worker_threads():
+    """ Threads each session worker may use for parallel kernels.  By default the CPUs are split
+        between the heavy requests that are allowed to run at once. """
+    default = max(1, os.cpu_count() // get_max_heavy_requests())
+    return max(1, plotplot_config.get_int_with_default('performance', 'worker_threads', default))
+
+
+def apply_thread_budget(num_threads):
+    """ Called at the start of a session worker process so all the workers together don't start more
+        threads than the machine has cores. """
+    for var in thread_budget_env_vars:
+        os.environ[var] = str(num_threads)
+
+    import numba
+    from numba.np.ufunc import parallel
+    if not parallel._is_initialized:
+        # Numba's thread pool is started on the first parallel kernel call, at this size.
+        numba.config.NUMBA_NUM_THREADS = num_threads
+    numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+
+
+def current_user_key():
+    """ Who a request belongs to for fairness.  Falls back to the client address when login is off. """
+    if not has_request_context():
+        return None
+    if current_user.is_authenticated:
+        return current_user.get_id()
+    return request.remote_addr
+
+
+def get_admission_controller():
+    global g_admission_controller
+    with g_admission_controller_lock:
+        if g_admission_controller is None:
+            g_admission_controller = AdmissionController(get_max_heavy_requests())
+        return g_admission_controller
+
+
+class AdmissionController():
+    """ Caps how many heavy requests run at once across all sessions.  Requests over the cap wait in
+        one queue per user, and users take turns so one user with many plots can't starve the rest. """
+
+    def __init__(self, max_running):
+        self.cond = threading.Condition()
+        self.max_running = max_running
+        self.running = 0
+        self.waiting = OrderedDict()  # user -> deque of tickets, in turn order.
+
+    @contextlib.contextmanager
+    def admit(self, user):
+        self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, user):
+        with self.cond:
+            if self.running < self.max_running and len(self.waiting) == 0:
+                self.running += 1
+                return
+
+            ticket = object()
+            self.waiting.setdefault(user, deque()).append(ticket)
+            while self.running >= self.max_running or not self.is_next(ticket):
+                self.cond.wait()
+
+            tickets = self.waiting.pop(user)
+            tickets.popleft()
+            if len(tickets) > 0:
+                # Back of the line for this user's next request.
+                self.waiting[user] = tickets
+            self.running += 1
+
+            # Another slot may still be free for the next user in line.
+            self.cond.notify_all()
+
+    def release(self):
+        with self.cond:
+            self.running -= 1
+            self.cond.notify_all()
+
+    def is_next(self, ticket):
+        first_user = next(iter(self.waiting))
+        return self.waiting[first_user][0] is ticket
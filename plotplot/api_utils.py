@@ -16,6 +16,7 @@ import uuid
 import locale
 
 from . import plotplot_config
+from .kernel_cache import kernel, parallel_kernel_lock
 
 
 locale.setlocale(locale.LC_ALL, '')
@@ -24,15 +25,191 @@ invalid_session_id_err_str = 'Invalid session ID. The server may have restarted;
 
 data_not_loaded_str = 'Data not yet loaded.'
 
+data_partial_str = 'The file is still loading.  Plots show the rows loaded so far, but this needs the whole file.'
+
+session_timeout_err_str = 'Session has timed out, you need to reload the page.'
+
 upload_folder = plotplot_config.get_upload_dir()
 gdrive_folder = os.path.join(plotplot_config.get_upload_dir(), 'gdrive')
 
+# Columnar formats, read with pyarrow.
+parquet_extensions = ['.parquet', '.pq']
+arrow_ipc_extensions = ['.feather', '.arrow', '.ipc']
+
+# CSVs can also be compressed with any of these (see compressed_input).
+compressed_extensions = ['.gz', '.bz2', '.xz', '.zst']
+
+# Files listed for loading from the upload and external folders.
+table_extensions = ['.csv'] + ['.csv' + ext for ext in compressed_extensions] + parquet_extensions + arrow_ipc_extensions
+
 max_rows_for_heatmap = 100000
 heatmap_x = 200
 heatmap_y = 200
 
 rank_col_name = 'y_plotplot_rank_832x9w3' # something unlikely to have overlap with data.
 
+# Row-wise Python work (like Levenshtein distances) is done in blocks this big so a cancelled request
+# can stop part way through.
+cancel_check_rows = 65536
+
+
+class RequestCancelled(Exception):
+    """ Raised inside a worker function when its request has been cancelled. """
+    pass
+
+
+class CancelToken():
+    """ Given to each heavy request.  The session worker cancels it when a newer request makes the
+        result useless, and long-running functions call check_cancelled() between subsets and chunks. """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+
+def check_cancelled(cancel_token):
+    """ Raises RequestCancelled if cancel_token (which may be None) has been cancelled. """
+    if cancel_token is not None and cancel_token.is_cancelled():
+        raise RequestCancelled()
+
+
+def apply_in_chunks(series, func, cancel_token, **kwargs):
+    """ series.apply(func, **kwargs), done cancel_check_rows rows at a time. """
+    if len(series) <= cancel_check_rows:
+        check_cancelled(cancel_token)
+        return series.apply(func, **kwargs)
+
+    chunks = []
+    for start in range(0, len(series), cancel_check_rows):
+        check_cancelled(cancel_token)
+        chunks.append(series.iloc[start:start + cancel_check_rows].apply(func, **kwargs))
+    return pd.concat(chunks)
+
+class ColumnCache():
+    """ Column values, finite masks, subset unions and gathered rows for one DataFrame, computed on
+        first use.  A request making several plots shares one, so each piece is only computed once.
+
+        Use gather() and gather_column() instead of df[idx][cols]: that copies every column for the
+        rows in idx and then throws away all but a few, these only copy the columns asked for.
+
+        stats is the session's ColumnStats for df, if it has one, and full_idxs the subset idxs that
+        select every row, whose statistics are the whole column's. """
+
+    def __init__(self, df, stats=None, full_idxs=()):
+        self.df = df
+        self.stats = stats
+        # Subset idxs are owned by the session's subsets, so their ids stay valid.
+        self.full_idxs = set(id(idx) for idx in full_idxs)
+        self.column_values = {}
+        self.finite_masks = {}
+        self.unions = {}
+        self.row_positions = {}
+        self.gathered = {}
+
+    def column_stats(self, col, idx):
+        """ Statistics for the column over the rows in idx, or None unless idx selects every row.  Masks
+            made from a subset's idx (e.g. narrowed to a bounding box) are different objects, so they
+            never use the statistics. """
+        if self.stats is None or id(idx) not in self.full_idxs or len(idx) != len(self.df):
+            return None
+        return self.stats.get(self.df, col, quantiles=False)
+
+    def all_finite(self, cols):
+        """ True if the statistics show every value of the columns is finite. """
+        return self.stats is not None and self.stats.all_finite(self.df, cols)
+
+    def values(self, col):
+        """ The column as a float numpy array.  Compacted float32 columns are used as they are. """
+        if col not in self.column_values:
+            values = np.asarray(self.df[col])
+            if values.dtype.kind != 'f':
+                values = values.astype(float)
+            self.column_values[col] = values
+        return self.column_values[col]
+
+    def finite(self, cols):
+        """ Mask of rows where every column in cols is finite. """
+        cols = tuple(cols)
+        if cols not in self.finite_masks:
+            if self.stats is not None:
+                # From the session's packed masks.
+                self.finite_masks[cols] = self.stats.finite(self.df, cols)
+            elif len(cols) == 1:
+                self.finite_masks[cols] = np.isfinite(self.values(cols[0]))
+            else:
+                self.finite_masks[cols] = self.finite(cols[:-1]) & self.finite(cols[-1:])
+        return self.finite_masks[cols]
+
+    def nan_partitions(self, x, y, rows):
+        """ The rows (a mask) where x or y are finite or not, see ColumnStats.nan_partitions. """
+        if self.stats is not None:
+            partitions = self.stats.nan_partitions(self.df, x, y)
+        else:
+            fx = self.finite((x, ))
+            fy = self.finite((y, ))
+            partitions = {
+                'null_x': ~fx & fy,
+                'null_y': fx & ~fy,
+                'null_both': ~fx & ~fy,
+                'non_null_x': fx,
+                'non_null_y': fy,
+                'non_null_both': fx & fy,
+            }
+        return {key: mask[rows] for key, mask in partitions.items()}
+
+    def in_ranges(self, idx, ranges):
+        """ idx & (low <= df[col] <= high) for each (col, low, high) in ranges (at most 3), as a numpy
+            mask.  One pass over the columns instead of a temporary mask per comparison.  NaN is never
+            in range; use (-finite_max, finite_max) to keep just the finite values. """
+        values = [self.values(col) for col, low, high in ranges]
+        if len(set(v.dtype for v in values)) > 1:
+            values = [v.astype(np.float64) for v in values]
+        values = [np.ascontiguousarray(v) for v in values]
+        # Unused columns are never read.
+        values += [values[0]] * (3 - len(values))
+        lows = np.array([low for col, low, high in ranges], dtype=np.float64)
+        highs = np.array([high for col, low, high in ranges], dtype=np.float64)
+        with parallel_kernel_lock:
+            return in_ranges_nb(np.ascontiguousarray(idx, dtype=bool), *values, lows, highs)
+
+    def rows(self, idx):
+        """ Positions of the rows selected by a mask. """
+        key = id(idx)
+        if key not in self.row_positions:
+            # The mask is kept with its positions, so its id isn't reused by another mask.
+            self.row_positions[key] = (idx, np.flatnonzero(np.asarray(idx)))
+        return self.row_positions[key][1]
+
+    def gather_column(self, col, idx):
+        """ df[idx][col], gathering just that column.  Keeps the row labels. """
+        key = (col, id(idx))
+        if key not in self.gathered:
+            self.gathered[key] = self.df[col].take(self.rows(idx))
+        return self.gathered[key]
+
+    def gather(self, cols, idx):
+        """ df[idx][cols] for a list of columns, gathering just those. """
+        if len(cols) < 1:
+            return pd.DataFrame(index=self.df.index.take(self.rows(idx)))
+        return pd.DataFrame({col: self.gather_column(col, idx) for col in cols}, copy=False)
+
+    def union(self, idxs):
+        """ Mask of rows in any of the subset idxs. """
+        # Subset idxs are owned by the session's subsets, so they live as long as this cache.
+        key = tuple(id(idx) for idx in idxs)
+        if key not in self.unions:
+            all_subsets_idx = np.zeros(len(self.df), dtype=bool)
+            for idx in idxs:
+                all_subsets_idx |= idx
+            self.unions[key] = all_subsets_idx
+        return self.unions[key]
+
+
 def get_gdrive_path(filename: str):
     return os.path.join(gdrive_folder, filename)
 
@@ -145,7 +322,7 @@ def do_autorange(x, y):
 
 
 # From: https://stackoverflow.com/a/59586544
-@nb.jit(nopython=True)
+@kernel([(nb.float64[::1], ), (nb.float32[::1], ), (nb.int64[::1], )])
 def extrema_while_nb(arr):
     """Returns max and min value of an array in a single transversal"""
     n = arr.size
@@ -168,6 +345,32 @@ def extrema_while_nb(arr):
         max_val = max(x, max_val)
     return max_val, min_val
 
+
+# ColumnCache.in_ranges() bounds that keep every finite value.
+finite_max = np.finfo(np.float64).max
+
+
+@kernel([(nb.boolean[::1], nb.float64[::1], nb.float64[::1], nb.float64[::1], nb.float64[::1], nb.float64[::1]),
+         (nb.boolean[::1], nb.float32[::1], nb.float32[::1], nb.float32[::1], nb.float64[::1], nb.float64[::1])],
+        parallel=True)
+def in_ranges_nb(idx, col0, col1, col2, lows, highs):
+    """idx & (lows[j] <= col_j <= highs[j]) for the first len(lows) columns, in one parallel pass.  NaN is
+    never in range."""
+    n = idx.size
+    num_cols = lows.size
+    out = np.empty(n, dtype=np.bool_)
+    for i in nb.prange(n):
+        keep = idx[i]
+        if keep and num_cols > 0:
+            keep = col0[i] >= lows[0] and col0[i] <= highs[0]
+        if keep and num_cols > 1:
+            keep = col1[i] >= lows[1] and col1[i] <= highs[1]
+        if keep and num_cols > 2:
+            keep = col2[i] >= lows[2] and col2[i] <= highs[2]
+        out[i] = keep
+    return out
+
+
 def generate_scatter(df,
                      x,
                      y,
@@ -183,18 +386,22 @@ def generate_scatter(df,
                      ylog,
                      row=None,
                      col=None,
-                     hoverlist=[]):
+                     hoverlist=[],
+                     cancel_token=None,
+                     column_cache=None):
     # Generate a scatter plot using Plotly.
     # idxs: an array of each subsets' true/false idx.  The user wants a plot combining all of these subsets, with different colors.
     num_points_for_hover = 20000
     plot_supports_hovering = False
-    df_x = np.array(df[x], dtype=float)
-    df_y = np.array(df[y], dtype=float)
+    if column_cache is None:
+        column_cache = ColumnCache(df)
+    df_x = column_cache.values(x)
+    df_y = column_cache.values(y)
 
     print(f'generate scatter, z: {z}')
     df_z = None
     if z is not None:
-        df_z = np.array(df[z], dtype=float)
+        df_z = column_cache.values(z)
 
     minmax = None
     cmin = None
@@ -207,15 +414,19 @@ def generate_scatter(df,
     longest_col_name_len = 0
 
     non_null_both_array = []
+    plot_cols = (x, y) if z is None else (x, y, z)
+    no_nans = column_cache.all_finite(plot_cols)
     for trace_num, idx in enumerate(idxs):
-        if z is None:
-            non_null_both = np.isfinite(df_x) & np.isfinite(df_y) & (idx)
+        check_cancelled(cancel_token)
+        if no_nans:
+            non_null_both = idx
         else:
-            non_null_both = np.isfinite(df_x) & np.isfinite(df_y) & np.isfinite(df_z) & (idx)
+            non_null_both = column_cache.finite(plot_cols) & (idx)
         non_null_both_array.append(non_null_both)
         max_num_valid = max(max_num_valid, np.sum(non_null_both))
 
     for trace_num, idx in enumerate(idxs):
+        check_cancelled(cancel_token)
         non_null_both = non_null_both_array[trace_num]
 
         num_nan += np.sum(idx) - np.sum(non_null_both)
@@ -224,8 +435,7 @@ def generate_scatter(df,
         # Compute data min/max
         if use_bbox:
             # Filter data to just our bounding box.
-            idx = (df[x] >= xmin_margin) & (df[x] <= xmax_margin) & (
-                df[y] >= ymin_margin) & (df[y] <= ymax_margin) & (idx)
+            idx = column_cache.in_ranges(idx, [(x, xmin_margin, xmax_margin), (y, ymin_margin, ymax_margin)])
 
             # Add a gray box so the user knows that outside this region is not loaded
             # 1e7 causes issues with the left/top boxes not tracking the axis well.
@@ -279,12 +489,22 @@ def generate_scatter(df,
                           col=col,
                           name='data-not-loaded-bottom')
 
-        if len(df[idx][x]) > max_rows_for_heatmap:
+        # Statistics cover whole columns, so they are only used when the rows plotted (after the
+        # bounding box) are every row.
+        x_stats = column_cache.column_stats(x, idx)
+        y_stats = column_cache.column_stats(y, idx)
+        z_stats = column_cache.column_stats(z, idx) if z is not None else None
+
+        if len(column_cache.rows(idx)) > max_rows_for_heatmap:
             # Plot is too big to send as a scatter plot.  Convert to a datashader plot.
             if xlog or ylog:
                 # When in log mode, Canvas needs the range.
-                xmax_data, xmin_data = extrema_while_nb(df[idx][x].values)
-                ymax_data, ymin_data = extrema_while_nb(df[idx][y].values)
+                if x_stats is not None and y_stats is not None:
+                    xmin_data, xmax_data = log_axis_range(x_stats)
+                    ymin_data, ymax_data = log_axis_range(y_stats)
+                else:
+                    xmax_data, xmin_data = extrema_while_nb(column_cache.gather_column(x, idx).values)
+                    ymax_data, ymin_data = extrema_while_nb(column_cache.gather_column(y, idx).values)
 
                 x_axis_type = 'linear'
                 y_axis_type = 'linear'
@@ -316,15 +536,18 @@ def generate_scatter(df,
             # datax.append(x[non_null_x].replace([np.inf, -np.inf], np.nan).dropna())
 
             if z is None:
-                agg = cvs.points(df[non_null_both_idx], x, y)
+                agg = cvs.points(column_cache.gather([x, y], non_null_both_idx), x, y)
             else:
-                agg = cvs.points(df[non_null_both_idx], x, y, datashader.mean(z))
+                agg = cvs.points(column_cache.gather([x, y, z], non_null_both_idx), x, y, datashader.mean(z))
 
                 # Can't do min/max on agg.values because then the color sliders won't do the full range
                 # because agg.values is mean not min/max.
-                idx_finite_z = (idx & np.isfinite(df_z))
-                cmin = float(df_z[idx_finite_z].min())
-                cmax = float(df_z[idx_finite_z].max())
+                if z_stats is not None:
+                    cmin, cmax = z_stats['min'], z_stats['max']
+                else:
+                    idx_finite_z = column_cache.in_ranges(idx, [(z, -finite_max, finite_max)])
+                    cmin = float(df_z[idx_finite_z].min())
+                    cmax = float(df_z[idx_finite_z].max())
                 
             #agg = cvs.points(dask_df[non_null_both_idx], x, y)
 
@@ -360,7 +583,8 @@ def generate_scatter(df,
                 minmax = merge_minmax([(xmin, xmax), (ymin, ymax), (cmin, cmax)], minmax)
 
         else:
-            if len(df[idx]) < num_points_for_hover:
+            num_rows = len(column_cache.rows(idx))
+            if num_rows < num_points_for_hover:
                 plot_supports_hovering = True
 
             cmin = np.nan
@@ -376,15 +600,19 @@ def generate_scatter(df,
                     'colorscale': 'Viridis',
                 }
 
-                idx_finite_z = (idx & np.isfinite(df_z))
+                if z_stats is not None:
+                    if z_stats['finite'] > 0:
+                        cmin, cmax = z_stats['min'], z_stats['max']
+                else:
+                    idx_finite_z = column_cache.in_ranges(idx, [(z, -finite_max, finite_max)])
 
-                if len(df_z[idx_finite_z]) > 0:
-                    cmin = float(df_z[idx_finite_z].min())
-                    cmax = float(df_z[idx_finite_z].max())
+                    if len(df_z[idx_finite_z]) > 0:
+                        cmin = float(df_z[idx_finite_z].min())
+                        cmax = float(df_z[idx_finite_z].max())
                 
 
-            if len(df[idx]) >= num_points_for_hover or len(hoverlist) == 0:
-                scatter = go.Scattergl(x=df[idx][x], y=df[idx][y], mode='markers', marker=marker, showlegend=False, hoverinfo='skip')
+            if num_rows >= num_points_for_hover or len(hoverlist) == 0:
+                scatter = go.Scattergl(x=column_cache.gather_column(x, idx), y=column_cache.gather_column(y, idx), mode='markers', marker=marker, showlegend=False, hoverinfo='skip')
             else:
                 max_col_len = 45
                 hoverlist_truncate = []
@@ -410,21 +638,25 @@ def generate_scatter(df,
                         return formatted_value
                     return " " + truncate_middle(value, 50)
 
-                hoverdata = df[idx][hoverlist].fillna(' ').applymap(format_str_for_hover)
+                hoverdata = column_cache.gather(hoverlist, idx).fillna(' ').applymap(format_str_for_hover)
 
-                scatter = go.Scattergl(x=df[idx][x], y=df[idx][y], mode='markers', marker=marker, hoverinfo='text', customdata=hoverdata, hovertemplate=templatelist, showlegend=False)
+                scatter = go.Scattergl(x=column_cache.gather_column(x, idx), y=column_cache.gather_column(y, idx), mode='markers', marker=marker, hoverinfo='text', customdata=hoverdata, hovertemplate=templatelist, showlegend=False)
                 fig.update_layout(hoverlabel=dict(bgcolor='white', font_size=14, font_family="monospace"), hovermode='closest')
             
             fig.add_trace(scatter, row=row, col=col)
 
-            # We can afford to compute min/max since there aren't that many points.
-            idx_finite_x = (idx & np.isfinite(df[x]))
-            idx_finite_y = (idx & np.isfinite(df[y]))
-
-            xmin = float(df[idx_finite_x][x].min())
-            xmax = float(df[idx_finite_x][x].max())
-            ymin = float(df[idx_finite_y][y].min())
-            ymax = float(df[idx_finite_y][y].max())
+            if x_stats is not None and y_stats is not None:
+                xmin, xmax = stats_range(x_stats)
+                ymin, ymax = stats_range(y_stats)
+            else:
+                # We can afford to compute min/max since there aren't that many points.
+                idx_finite_x = column_cache.in_ranges(idx, [(x, -finite_max, finite_max)])
+                idx_finite_y = column_cache.in_ranges(idx, [(y, -finite_max, finite_max)])
+
+                xmin = float(column_cache.gather_column(x, idx_finite_x).min())
+                xmax = float(column_cache.gather_column(x, idx_finite_x).max())
+                ymin = float(column_cache.gather_column(y, idx_finite_y).min())
+                ymax = float(column_cache.gather_column(y, idx_finite_y).max())
             if minmax is None:
                 minmax = [(xmin, xmax), (ymin, ymax), (cmin, cmax)]
             else:
@@ -432,6 +664,19 @@ def generate_scatter(df,
     
     return fig, minmax, num_nan, is_heatmap, plot_supports_hovering, longest_col_name_len
 
+def stats_range(stats):
+    """ (min, max) from ColumnStats, NaN if the column has no finite values. """
+    if stats['finite'] < 1:
+        return np.nan, np.nan
+    return stats['min'], stats['max']
+
+def log_axis_range(stats):
+    """ (min, max) for a log axis from ColumnStats: starts at the smallest positive value. """
+    xmin, xmax = stats_range(stats)
+    if stats['positive_min'] is not None and not xmin > 0:
+        xmin = stats['positive_min']
+    return xmin, xmax
+
 def truncate_middle(s, n):
     if len(s) <= n:
         # string is already short-enough
@@ -445,10 +690,12 @@ def truncate_middle(s, n):
 
 def generate_scatter_and_nans(df, x, y, z, idxs, fig, use_bbox,
                               xmin_margin, xmax_margin, ymin_margin,
-                              ymax_margin, xlog, ylog, hoverlist):
+                              ymax_margin, xlog, ylog, hoverlist, cancel_token=None, column_cache=None):
     # WARNING: Don't change 0.85 and 0.15 without updating the values
     # in PlotGroup.js
     start = time.time()
+    if column_cache is None:
+        column_cache = ColumnCache(df)
     fig = fig.set_subplots(2,
                            2,
                            column_widths=[0.85, 0.15],
@@ -474,24 +721,26 @@ def generate_scatter_and_nans(df, x, y, z, idxs, fig, use_bbox,
                                                         ylog,
                                                         row=2,
                                                         col=1,
-                                                        hoverlist=hoverlist)
+                                                        hoverlist=hoverlist,
+                                                        cancel_token=cancel_token,
+                                                        column_cache=column_cache)
     print('after generate_scatter', time.time() - start)
+    check_cancelled(cancel_token)
 
-    all_subsets_idx = np.zeros(len(df), dtype=bool)
-    for idx in idxs:
-        all_subsets_idx |= idx
+    all_subsets_idx = column_cache.union(idxs)
     # Find rows that are null in X but valid in Y (and vice versa):
-    df_x = df[all_subsets_idx][x]
-    df_y = df[all_subsets_idx][y]
+    df_x = column_cache.gather_column(x, all_subsets_idx)
+    df_y = column_cache.gather_column(y, all_subsets_idx)
 
-    null_x = ~np.isfinite(df_x) & np.isfinite(df_y)
-    null_y = (np.isfinite(df_x)) & (~np.isfinite(df_y))
-    null_both = ~np.isfinite(df_x) & ~np.isfinite(df_y)
-    non_null_x = np.isfinite(df_x)
-    non_null_y = np.isfinite(df_y)
-    non_null_both = np.isfinite(df_x) & np.isfinite(df_y)
+    partitions = column_cache.nan_partitions(x, y, all_subsets_idx)
+    null_x = partitions['null_x']
+    null_y = partitions['null_y']
+    null_both = partitions['null_both']
+    non_null_x = partitions['non_null_x']
+    non_null_y = partitions['non_null_y']
 
     both_nan = np.sum(null_both)
+    check_cancelled(cancel_token)
 
     # Do auto-scaling
     nbins, valmax = AutoScaleHistogram(df_x, df_y, null_x, null_y, non_null_x,
@@ -501,18 +750,20 @@ def generate_scatter_and_nans(df, x, y, z, idxs, fig, use_bbox,
 
     assert len(df_x) == len(df_y)
 
-    trace_top_nan = generate_nan_histogram(df_x, null_y, nbins, 'top')
+    trace_top_nan = generate_nan_histogram(df_x, null_y, nbins, 'top', non_null=non_null_x)
     trace_top_nonnan = generate_nan_histogram(df_x,
                                               non_null_x,
                                               nbins,
                                               'top',
-                                              stepgraph=True)
-    trace_right_nan = generate_nan_histogram(df_y, null_x, nbins, 'right')
+                                              stepgraph=True,
+                                              non_null=non_null_x)
+    trace_right_nan = generate_nan_histogram(df_y, null_x, nbins, 'right', non_null=non_null_y)
     trace_right_nonnan = generate_nan_histogram(df_y,
                                                 non_null_y,
                                                 nbins,
                                                 'right',
-                                                stepgraph=True)
+                                                stepgraph=True,
+                                                non_null=non_null_y)
 
     # trace_top_nan = generate_nan_histogram(df_x, null_y, nbins, 'top')
     # trace_top_nonnan = generate_nan_histogram(df_x, null_y, nbins, 'top', stepgraph=True)
@@ -572,8 +823,10 @@ def get_rank_df(df, y, z, hoverlist):
     return pd.DataFrame(df_out)
 
 
-def generate_histogram(df, idxs, fig, x, nbins, hist_type):
+def generate_histogram(df, idxs, fig, x, nbins, hist_type, cancel_token=None, column_cache=None):
     minmax = None
+    if column_cache is None:
+        column_cache = ColumnCache(df)
 
     if hist_type is None:
         hist_type = 'count'
@@ -582,12 +835,18 @@ def generate_histogram(df, idxs, fig, x, nbins, hist_type):
     data_finite_list = []
 
     for idx in idxs:
+        check_cancelled(cancel_token)
         # Drop nans.
-        data_finite = df[idx][x].replace([np.inf, -np.inf], np.nan).dropna()
+        data_finite = column_cache.gather_column(x, idx).replace([np.inf, -np.inf], np.nan).dropna()
         if len(data_finite) < 1:
             continue
-        data_min = min(data_finite)
-        data_max = max(data_finite)
+        # None unless idx is every row, see ColumnCache.column_stats().
+        x_stats = column_cache.column_stats(x, idx)
+        if x_stats is not None:
+            data_min, data_max = x_stats['min'], x_stats['max']
+        else:
+            data_min = min(data_finite)
+            data_max = max(data_finite)
 
         if minmax is None:
             minmax = [data_min, data_max]
@@ -667,12 +926,14 @@ def get_filename_from_uuid_filename(uuid_filename):
         return uuid_filename[36+1:] # plus 1 for the "-" we add: uuid4-filename.csv
     return uuid_filename
 
-def generate_nan_histogram(data, indexes, bins, position, stepgraph=False):
+def generate_nan_histogram(data, indexes, bins, position, stepgraph=False, non_null=None):
+    """ non_null: np.isfinite(data), if the caller already has it. """
     if len(data) < 1:
         # no data
         return None
 
-    non_null = np.isfinite(data)
+    if non_null is None:
+        non_null = np.isfinite(data)
     data_min = np.min(data[non_null])
     data_max = np.max(data[non_null])
 
@@ -770,8 +1031,9 @@ def AutoScaleHistogram(x, y, null_x, null_y, non_null_x, non_null_y):
     ymin = np.min(datay[-1])
     ymax = np.max(datay[-1])
 
-    non_null_x = np.sum(np.isfinite(x))
-    non_null_y = np.sum(np.isfinite(y))
+    # The masks are np.isfinite(x) and np.isfinite(y).
+    non_null_x = np.count_nonzero(non_null_x)
+    non_null_y = np.count_nonzero(non_null_y)
 
     n = len(x)
     nbins = []
@@ -884,7 +1146,7 @@ def copy_with_progress_thread(source, destination, callback):
             callback(copied * 100 / source_size)
 
 
-def calculate_correlation(df: pd.DataFrame, x_col: str, y_col: str):
+def calculate_correlation(df: pd.DataFrame, x_col: str, y_col: str, cancel_token=None):
     """
     A method for calculating the correlation between two columns in a data frame and returns R and R^2.
     Used because the corr method of pandas correlates all columns with all others by default, which is more intensive than needed.
@@ -901,12 +1163,23 @@ def calculate_correlation(df: pd.DataFrame, x_col: str, y_col: str):
             correlations[method] = (np.float64(1), np.float64(1))
             continue
 
+        # Kendall is by far the slowest, so make sure nobody cancelled while the others ran.
+        check_cancelled(cancel_token)
         r = df[[x_col, y_col]].corr(method=method)[x_col][y_col]
         r_sq = np.square(r)
         correlations[method] = (r, r_sq)
 
     return correlations
 
+def widen_for_math(col):
+    """ The column as int64 or float64 if it was stored in a narrower type (see compact_dtypes in
+        load_csv_thread.py), so arithmetic on it gives the same results as on the full-width column. """
+    if col.dtype.kind in 'iu' and col.dtype.itemsize < 8:
+        return col.astype(np.int64)
+    if col.dtype == np.float32:
+        return col.astype(np.float64)
+    return col
+
 def do_math_helper(df, math_vars, raw_expr):
     """
     Performs math on a dataframe given a math expression like:
@@ -927,10 +1200,11 @@ def do_math_helper(df, math_vars, raw_expr):
 
     df_expression = expression.replace('<mathvar>',
                                         'df["').replace('</mathvar>', '"]')
-    name_expression = expression.replace('<mathvar>',
-                                            '').replace('</mathvar>', '')
+    name_expression = math_var_column_name(raw_expr)
 
     try:
+        # Just the columns used, widened so compacted columns don't overflow.
+        df = {name: widen_for_math(df[name]) for name in math_var_refs(raw_expr)}
         print(df_expression)
         new_col = pd.eval(df_expression)
         print(new_col)
@@ -946,6 +1220,16 @@ def do_math_helper(df, math_vars, raw_expr):
 
     return out
 
+def math_var_column_name(raw_expr):
+    """ The column a math variable is stored in: its expression without the <mathvar> tags. """
+    expression = html.unescape(raw_expr).replace(u"\u00a0", ' ')
+    return expression.replace('<mathvar>', '').replace('</mathvar>', '')
+
+def math_var_refs(raw_expr):
+    """ The columns a math variable's expression uses, the names inside its <mathvar> tags. """
+    expression = html.unescape(raw_expr).replace(u"\u00a0", ' ')
+    return set(re.findall('<mathvar>(.*?)</mathvar>', expression, flags=re.DOTALL))
+
 def pack_math_var(raw_expr, name, is_visible):
     return [raw_expr, name, is_visible]
 
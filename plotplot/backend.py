@@ -4,6 +4,7 @@ from flask import jsonify
 from flask import request
 from flask import g
 from flask import send_from_directory
+from flask import Response, stream_with_context
 import pandas as pd
 import json
 import plotly
@@ -29,8 +30,10 @@ from plotplot.login import app_login
 from plotplot.load_and_resume import app_load_and_resume
 from plotplot.user import User
 from plotplot.globals import g_process_lock, g_processes
-from plotplot.session_worker import call_worker
+from plotplot.session_worker import call_worker, call_worker_stream
 from plotplot.plotplot_config import get_plotplot_config
+from plotplot import kernel_cache
+from plotplot import worker_pool
 
 plotplot_config = get_plotplot_config()
 
@@ -64,6 +67,12 @@ app.register_blueprint(app_load_and_resume)
 
 app.secret_key = os.urandom(24)
 
+# Compile (or load from the disk cache) the JIT kernels and start the idle session workers when the app
+# is loaded, by the plotplot command or a WSGI server (gunicorn in the Docker image).  Workers are
+# forked from this process so they start with the kernels ready and are warm by the first load.
+kernel_cache.precompile()
+worker_pool.get_worker_pool().fill()
+
 # These routes just load the main index.html file which will immediately
 # detect that there is an argument in the URL and handle it.
 @app.route('/')
@@ -121,6 +130,21 @@ def plot_json(data_id=None):
     })
 
 
+@app.route('/api/<data_id>/plot_batch', methods=['POST'])
+@login_required
+@exception_decorator
+def plot_batch(data_id=None):
+    """ Takes {"plots": [plot_json request, ...]} and streams back one JSON line per plot as each
+        finishes: {"index": i, "result": <plot_json response>}. """
+    if data_id is None:
+        return json.dumps({'error': invalid_session_id_err_str})
+
+    return Response(stream_with_context(call_worker_stream(data_id, 'plot_batch', {
+        'current_user_email': current_user.email,
+        'data': request.get_json()
+    })), mimetype='application/x-ndjson')
+
+
 @app.route('/api/<data_id>/calc_r', methods=['POST'])
 @login_required
 @exception_decorator
@@ -203,6 +227,16 @@ def levenshtein_filter(data_id=None):
 
     return call_worker(data_id, 'levenshtein_filter', {'data': request.get_json()})
 
+@app.route('/api/<data_id>/column_stats', methods=['POST'])
+@login_required
+@exception_decorator
+def column_stats(data_id=None):
+    """ Takes {"column": name}. """
+    if data_id is None:
+        return json.dumps({'error': invalid_session_id_err_str})
+
+    return call_worker(data_id, 'column_stats', {'data': request.get_json()})
+
 @app.route('/api/<data_id>/get_unique_strings', methods=['POST'])
 @login_required
 @exception_decorator
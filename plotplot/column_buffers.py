@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+class ColumnBuffers():
+    """ One numpy array per column, allocated up front for the expected number of rows and filled in
+        place as parsed blocks arrive, so building the DataFrame doesn't need a concat (and twice the
+        memory).  Arrays grow if there are more rows than expected, and a column's dtype is widened if a
+        later block needs it (int -> float -> object). """
+
+    # How much to grow by when the buffers fill up.
+    growth_factor = 1.5
+
+    def __init__(self, expected_rows):
+        self.capacity = max(1, int(expected_rows))
+        self.num_rows = 0
+        self.columns = {}
+        # Set once view() has handed out arrays that share memory with the buffers.
+        self.shared = False
+
+    def append(self, block):
+        """ block: dict of column name -> numpy array, all with the same length. """
+        if len(block) < 1:
+            return
+        n = len(next(iter(block.values())))
+        if self.num_rows + n > self.capacity:
+            self.grow(self.num_rows + n)
+
+        for name, values in block.items():
+            buf = self.columns.get(name)
+            if buf is None:
+                buf = np.empty(self.capacity, dtype=values.dtype)
+                self.columns[name] = buf
+            elif not np.can_cast(values.dtype, buf.dtype, 'safe'):
+                buf = buf.astype(np.result_type(buf.dtype, values.dtype))
+                self.columns[name] = buf
+            buf[self.num_rows:self.num_rows + n] = values
+        self.num_rows += n
+
+    def add_column(self, name, values):
+        """ Adds a column that already has a value for every row filled so far. """
+        buf = np.empty(self.capacity, dtype=values.dtype)
+        buf[:self.num_rows] = values
+        self.columns[name] = buf
+
+    def drop(self, name):
+        del self.columns[name]
+
+    def grow(self, min_rows):
+        self.capacity = max(min_rows, int(self.capacity * self.growth_factor))
+        for name, buf in self.columns.items():
+            if self.shared:
+                # Resizing in place could move the memory out from under the views.
+                new_buf = np.empty(self.capacity, dtype=buf.dtype)
+                new_buf[:self.num_rows] = buf[:self.num_rows]
+                self.columns[name] = new_buf
+            else:
+                buf.resize(self.capacity, refcheck=False)
+
+    def view(self):
+        """ DataFrame over the rows filled so far, sharing memory with the buffers.  Later appends
+            don't change it: they write past its end, or into new arrays if the buffers grow. """
+        self.shared = True
+        return pd.DataFrame({name: buf[:self.num_rows] for name, buf in self.columns.items()}, copy=False)
+
+    def to_dataframe(self):
+        """ Trims the buffers to the rows filled and wraps them in a DataFrame without copying. """
+        if self.shared:
+            # Can't trim in place under the views, so the spare capacity stays.
+            return self.view()
+        for buf in self.columns.values():
+            buf.resize(self.num_rows, refcheck=False)
+        self.capacity = self.num_rows
+        return pd.DataFrame(self.columns, copy=False)
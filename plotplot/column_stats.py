@@ -0,0 +1,216 @@
+import threading
+import numpy as np
+import numba as nb
+from concurrent.futures import ThreadPoolExecutor
+from .kernel_cache import kernel
+
+# Quantiles are estimated from an evenly spaced sample of about this many rows.
+quantile_sample_rows = 100000
+quantile_levels = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+@kernel([(nb.float64[::1], ), (nb.float32[::1], )], nogil=True)
+def float_stats_nb(arr):
+    """ NaN and infinite counts, and the finite min, max and smallest positive value, in one pass. """
+    nan_count = 0
+    inf_count = 0
+    min_val = np.inf
+    max_val = -np.inf
+    positive_min = np.inf
+    for i in range(arr.size):
+        v = arr[i]
+        if np.isnan(v):
+            nan_count += 1
+        elif np.isinf(v):
+            inf_count += 1
+        else:
+            if v < min_val:
+                min_val = v
+            if v > max_val:
+                max_val = v
+            if v > 0 and v < positive_min:
+                positive_min = v
+    return nan_count, inf_count, min_val, max_val, positive_min
+
+
+def is_stats_dtype(dtype):
+    return dtype.kind in 'iuf'
+
+
+def estimate_quantiles(values):
+    sample = values[::max(1, len(values) // quantile_sample_rows)]
+    if sample.dtype.kind == 'f':
+        sample = sample[np.isfinite(sample)]
+    if len(sample) < 1:
+        return None
+    return dict(zip([str(q) for q in quantile_levels], np.quantile(sample, quantile_levels).tolist()))
+
+
+def compute_stats(values):
+    """ Statistics for one numeric column (a numpy array). """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        values = np.ascontiguousarray(values)
+        if values.dtype != np.float32:
+            values = values.astype(np.float64, copy=False)
+        nan_count, inf_count, min_val, max_val, positive_min = float_stats_nb(values)
+    else:
+        nan_count, inf_count = 0, 0
+        min_val, max_val = (values.min(), values.max()) if len(values) > 0 else (np.inf, -np.inf)
+        positive = values[values > 0] if len(values) > 0 and min_val <= 0 else values
+        positive_min = positive.min() if len(positive) > 0 else np.inf
+
+    finite = len(values) - nan_count - inf_count
+    return {
+        'rows': len(values),
+        'finite': int(finite),
+        'nan': int(nan_count),
+        'inf': int(inf_count),
+        'min': float(min_val) if finite > 0 else None,
+        'max': float(max_val) if finite > 0 else None,
+        'positive_min': float(positive_min) if np.isfinite(positive_min) else None,
+        'quantiles': estimate_quantiles(values),
+    }
+
+
+def merge_stats(a, b):
+    """ Statistics for the rows of a followed by the rows of b.  The quantiles are left for get() to
+        estimate again. """
+    def merged(key, f):
+        if a[key] is None:
+            return b[key]
+        if b[key] is None:
+            return a[key]
+        return f(a[key], b[key])
+
+    return {
+        'rows': a['rows'] + b['rows'],
+        'finite': a['finite'] + b['finite'],
+        'nan': a['nan'] + b['nan'],
+        'inf': a['inf'] + b['inf'],
+        'min': merged('min', min),
+        'max': merged('max', max),
+        'positive_min': merged('positive_min', min),
+        'quantiles': None,
+    }
+
+
+class ColumnStats():
+    """ Per-column statistics for a session's data: finite, NaN and infinite counts, the finite
+        min/max, the smallest positive value (for log axes) and approximate quantiles.  Built once at
+        load and kept up to date as columns and rows are added, so plots don't have to scan a whole
+        column to find them.
+
+        It also keeps each column's finite-value mask, packed 8 rows to a byte, so NaN checks and the
+        NaN/non-NaN partitions are bitwise operations on cached masks instead of scans of the column.
+
+        Change it only with the session's data_rw_lock held for writing, like the data it describes.
+        Readers may fill in columns that haven't been computed yet. """
+
+    def __init__(self):
+        self.stats = {}
+        self.finite_bits = {}  # column name -> np.packbits of its finite mask
+        self.lock = threading.Lock()
+
+    def build(self, df, num_threads):
+        """ Computes every numeric column of df, the columns in parallel. """
+        columns = [name for name in df.columns if is_stats_dtype(df[name].dtype)]
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            results = list(executor.map(lambda name: compute_stats(df[name].to_numpy()), columns))
+        with self.lock:
+            self.stats.update(zip(columns, results))
+
+    def get(self, df, name, quantiles=True):
+        """ Statistics for a column of df, or None if it isn't numeric.  Columns that weren't built at
+            load are computed on first use.  Pass quantiles=False if they aren't needed, they may be out
+            of date after rows were appended. """
+        with self.lock:
+            stats = self.stats.get(name)
+        if stats is not None and (not quantiles or stats['quantiles'] is not None):
+            return stats
+
+        if name not in df.columns:
+            return None
+        values = np.asarray(df[name])
+        if not is_stats_dtype(values.dtype):
+            return None
+        if stats is None:
+            stats = compute_stats(values)
+        else:
+            stats = dict(stats)
+            stats['quantiles'] = estimate_quantiles(values)
+        with self.lock:
+            self.stats[name] = stats
+        return stats
+
+    def add(self, name, values):
+        """ A column was added (or replaced). """
+        values = np.asarray(values)
+        stats = compute_stats(values) if is_stats_dtype(values.dtype) else None
+        with self.lock:
+            self.finite_bits.pop(name, None)
+            if stats is None:
+                self.stats.pop(name, None)
+            else:
+                self.stats[name] = stats
+
+    def append(self, block):
+        """ Rows were appended.  block: column name -> numpy array of the new rows. """
+        with self.lock:
+            # Rebuilt on next use.
+            for name in block:
+                self.finite_bits.pop(name, None)
+            names = [name for name in block if name in self.stats]
+        new_stats = {name: compute_stats(block[name]) for name in names if is_stats_dtype(np.asarray(block[name]).dtype)}
+        with self.lock:
+            for name in names:
+                if name in new_stats:
+                    self.stats[name] = merge_stats(self.stats[name], new_stats[name])
+                else:
+                    # Widened to a non-numeric type.
+                    del self.stats[name]
+
+    def all_finite(self, df, cols):
+        """ True if every value in each of the columns is finite. """
+        for col in cols:
+            stats = self.get(df, col, quantiles=False)
+            if stats is None or stats['finite'] != stats['rows']:
+                return False
+        return True
+
+    def packed_finite(self, df, name):
+        with self.lock:
+            bits = self.finite_bits.get(name)
+        if bits is None:
+            values = np.asarray(df[name])
+            if values.dtype.kind in 'iub':
+                mask = np.ones(len(values), dtype=bool)
+            else:
+                mask = np.isfinite(values if values.dtype.kind == 'f' else values.astype(float))
+            bits = np.packbits(mask)
+            with self.lock:
+                self.finite_bits[name] = bits
+        return bits
+
+    def finite(self, df, cols):
+        """ Mask of rows where every column in cols is finite. """
+        bits = self.packed_finite(df, cols[0])
+        for col in cols[1:]:
+            bits = bits & self.packed_finite(df, col)
+        return np.unpackbits(bits, count=len(df)).view(bool)
+
+    def nan_partitions(self, df, x, y):
+        """ Masks of the rows where x or y are finite or not:
+            {'null_x': x not finite, y finite, 'null_y': x finite, y not, 'null_both': neither,
+             'non_null_x': x finite, 'non_null_y': y finite, 'non_null_both': both} """
+        fx = self.packed_finite(df, x)
+        fy = self.packed_finite(df, y)
+        partitions = {
+            'null_x': ~fx & fy,
+            'null_y': fx & ~fy,
+            'null_both': ~(fx | fy),
+            'non_null_x': fx,
+            'non_null_y': fy,
+            'non_null_both': fx & fy,
+        }
+        return {key: np.unpackbits(bits, count=len(df)).view(bool) for key, bits in partitions.items()}
@@ -0,0 +1,171 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def open_zstd(raw):
+    if zstandard is None:
+        raise Exception('Reading .zst files needs zstandard: pip install "plotplot[zstd]"')
+    return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+
+
+# Compressed file extension -> opens a decompressed stream over the raw file.
+openers = {
+    '.gz': lambda raw: gzip.GzipFile(fileobj=raw, mode='rb'),
+    '.bz2': lambda raw: bz2.BZ2File(raw, mode='rb'),
+    '.xz': lambda raw: lzma.LZMAFile(raw, mode='rb'),
+    '.zst': open_zstd,
+}
+
+
+def get_compression(path):
+    """ The compression extension of path, or None if it isn't compressed. """
+    ext = os.path.splitext(path)[1].lower()
+    return ext if ext in openers else None
+
+
+def open_input(path):
+    """ Opens a file for reading in binary mode, decompressing it if it is compressed. """
+    compression = get_compression(path)
+    if compression is None:
+        return open(path, 'rb')
+    return DecompressingReader(path, compression)
+
+
+class DecompressingReader(io.RawIOBase):
+    """ Binary file object over the decompressed contents of a file.  Decompression runs on its own
+        thread a few blocks ahead of the reader, so it overlaps with parsing.
+
+        tell() is the position in the compressed file, so it can be used for progress against the
+        file's size.  The only seek supported is back to the start, which restarts decompression. """
+
+    block_bytes = 4 * 1024 * 1024
+
+    # How many decompressed blocks can be waiting for the reader.
+    queue_blocks = 4
+
+    def __init__(self, path, compression):
+        io.RawIOBase.__init__(self)
+        self.path = path
+        self.compression = compression
+        self.thread = None
+        # The ratio seen before the last rewind, until more is read.
+        self.rewound_ratio = 0.0
+        self.start()
+
+    def start(self):
+        self.blocks = queue.Queue(maxsize=self.queue_blocks)
+        self.stopping = threading.Event()
+        self.current = memoryview(b'')
+        self.offset = 0
+        self.finished = False
+        # Compressed and decompressed sizes of the blocks received so far.
+        self.compressed_pos = 0
+        self.decompressed_pos = 0
+        self.thread = threading.Thread(target=self.decompress, args=(self.blocks, self.stopping), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def decompress(self, blocks, stopping):
+        try:
+            with open(self.path, 'rb') as raw, openers[self.compression](raw) as stream:
+                while not stopping.is_set():
+                    data = stream.read(self.block_bytes)
+                    self.put(blocks, stopping, (data, raw.tell(), None))
+                    if len(data) < 1:
+                        return
+        except Exception as e:
+            self.put(blocks, stopping, (b'', self.compressed_pos, e))
+
+    @staticmethod
+    def put(blocks, stopping, item):
+        # Gives up if the reader has gone away, rather than waiting for room forever.
+        while not stopping.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def next_block(self):
+        """ Waits for the next decompressed block.  Returns False at the end of the file. """
+        if self.finished:
+            return False
+        data, compressed_pos, error = self.blocks.get()
+        if error is not None:
+            self.finished = True
+            raise error
+        self.compressed_pos = compressed_pos
+        if len(data) < 1:
+            self.finished = True
+            return False
+        self.decompressed_pos += len(data)
+        self.current = memoryview(data)
+        self.offset = 0
+        return True
+
+    def take(self, size):
+        """ Up to size bytes from the current block. """
+        data = self.current[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def readinto(self, b):
+        if self.offset >= len(self.current) and not self.next_block():
+            return 0
+        data = self.take(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def read(self, size=-1):
+        """ Like a buffered file, returns size bytes unless the end of the file is reached. """
+        out = bytearray()
+        while size < 0 or len(out) < size:
+            if self.offset >= len(self.current) and not self.next_block():
+                break
+            out += self.take(len(self.current) if size < 0 else size - len(out))
+        return bytes(out)
+
+    def compression_ratio(self):
+        """ Decompressed bytes per compressed byte, so far.  After a rewind, the ratio of what was read
+            before it. """
+        if self.decompressed_pos < 1:
+            return self.rewound_ratio
+        return self.decompressed_pos / max(1, self.compressed_pos)
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('Compressed files can only be rewound to the start.')
+        # Kept so the file can be sampled, rewound, and then its size estimated.
+        self.rewound_ratio = self.compression_ratio()
+        self.stop()
+        self.start()
+        return 0
+
+    def tell(self):
+        return self.compressed_pos
+
+    def close(self):
+        self.stop()
+        io.RawIOBase.close(self)
@@ -0,0 +1,47 @@
+import time
+import threading
+import numba
+from . import plotplot_config
+
+# Compiled kernels are written here and reused by every worker and across restarts.  This has to be set
+# before any kernel is defined, so modules with kernels import this one first and use kernel() below.
+numba.config.CACHE_DIR = plotplot_config.get_kernel_cache_dir()
+
+# (dispatcher, signatures) for every kernel, so they can be compiled ahead of time.
+g_kernels = []
+
+# Held while a parallel=True kernel runs.  Numba's workqueue threading layer (used when TBB and OpenMP
+# aren't installed) can't run parallel kernels from two threads at once, and a session's read-only
+# requests run on several threads.  Each parallel kernel already uses all of the worker's threads.
+parallel_kernel_lock = threading.Lock()
+
+
+def kernel(signatures, **jit_options):
+    """ Like numba.njit, with the on-disk cache turned on.  The signatures are the argument types the
+        kernel is normally called with and are compiled by precompile().  Other types are still
+        compiled lazily on first call. """
+    def decorator(func):
+        dispatcher = numba.njit(cache=True, **jit_options)(func)
+        g_kernels.append((dispatcher, signatures))
+        return dispatcher
+    return decorator
+
+
+def precompile():
+    """ Compiles (or loads from the cache) every kernel for its listed signatures and reports which
+        were served from the cache. """
+    start_time = time.time()
+    for dispatcher, signatures in g_kernels:
+        for sig in signatures:
+            hits_before = sum(dispatcher.stats.cache_hits.values())
+            dispatcher.compile(sig)
+            from_cache = sum(dispatcher.stats.cache_hits.values()) > hits_before
+            print(f'Kernel {dispatcher.__name__}{sig}: ' + ('loaded from cache' if from_cache else 'compiled'))
+    print(f'Kernels ready in {time.time() - start_time:.2f} seconds (cache: {numba.config.CACHE_DIR})')
+
+
+if __name__ == '__main__':
+    # Run at install time to fill the cache: python -m plotplot.kernel_cache
+    # Kernels register with the imported copy of this module, not with __main__.
+    from . import api_utils, point_in_polygon, column_stats, kernel_cache
+    kernel_cache.precompile()
@@ -1,4 +1,4 @@
-from flask import request, Blueprint
+from flask import request, Blueprint, Response
 from flask.cli import with_appcontext
 import numpy as np
 import pandas as pd
@@ -16,7 +16,9 @@ import glob
 from .db import init_db_command, insert_db, query_db
 import sys
 import multiprocessing as mp
-from .session_worker import SessionRequest, SessionWorker, call_worker
+from .session_worker import SessionRequest, SessionWorker, ResponseDispatcher, call_worker, get_process_data
+from .progress_relay import ProgressRelay
+from . import worker_pool
 from .gdrive_cloud import PlotplotGdrive
 from zoneinfo import ZoneInfo
 from flask_login import (
@@ -36,7 +38,10 @@ def processing_progress():
     if id is None:
         return json.dumps({'error': 'ID is null.'})
 
-    return call_worker(id, 'processing_progress', {})
+    pdata, error = get_process_data(id)
+    if pdata is None:
+        return error
+    return pdata['progress'].get('loading')
 
 
 @app_load_and_resume.route('/api/cloud_progress')
@@ -47,7 +52,55 @@ def cloud_progress():
     if id is None:
         return json.dumps({'error': 'ID is null.'})
 
-    return call_worker(id, 'cloud_progress', {})
+    pdata, error = get_process_data(id)
+    if pdata is None:
+        return error
+    return pdata['progress'].get('cloud')
+
+
+# How long the browser waits before asking for more progress, in milliseconds (the SSE retry field).
+progress_retry_ms = 500
+
+# The same once a followed file has loaded.  New rows are only checked for every follow_poll_seconds
+# (load_csv_thread.py) anyway, and a followed session is polled for as long as it is open.
+follow_retry_ms = 2000
+
+
+@app_load_and_resume.route('/api/progress_stream')
+@login_required
+def progress_stream():
+    """ Server-sent events with the session's progress: "cloud" events while a Google Drive file
+        downloads and "loading" events while the data loads, then "follow" events as rows are appended
+        to a followed file.
+
+        Each request answers right away with the progress that changed since the browser's
+        Last-Event-ID and ends, and the retry field has the EventSource ask again a moment later.  A
+        server thread never waits for a load, so many loads at once can't use up the server's
+        threads.  Once loading is done (or following stops) or fails, and the browser has seen it, the
+        reply is 204, which stops the EventSource. """
+    id = get_str(request.args.get('data_id'))
+    if id is None:
+        return json.dumps({'error': 'ID is null.'})
+
+    pdata, error = get_process_data(id)
+    if pdata is None:
+        # Sent as an event so the page sees it like any other progress.
+        return Response('event: loading\ndata: ' + error + '\n\n', mimetype='text/event-stream')
+
+    relay = pdata['progress']
+    finished = relay.is_finished()
+    if not finished and not relay.is_alive():
+        # The worker exited part way through, no more progress is coming.
+        error = json.dumps({'error': api_utils.session_timeout_err_str, 'session_timeout': True})
+        return Response('event: loading\ndata: ' + error + '\n\n', mimetype='text/event-stream')
+    changed, version_id = relay.changed_since(request.headers.get('Last-Event-ID'))
+    if len(changed) == 0 and finished:
+        return Response(status=204)
+
+    events = ['retry: ' + str(follow_retry_ms if relay.is_following() else progress_retry_ms) + '\n\n']
+    for kind in changed:
+        events.append('event: ' + kind + '\nid: ' + version_id + '\ndata: ' + relay.get(kind) + '\n\n')
+    return Response(''.join(events), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 
 # dask_df = dd.from_pandas(df, npartitions=mp.cpu_count())
@@ -56,26 +109,32 @@ def cloud_progress():
 ########################
 
 
-def load_data(path, gdrive_file_info=None, data_id=None, subsets_from_db=None, math_vars=None):
+def load_data(path, gdrive_file_info=None, data_id=None, subsets_from_db=None, math_vars=None, follow=False):
     global g_processes
     if data_id is None:
         data_id = str(uuid.uuid4())
     else:
         assert subsets_from_db is not None
 
-    # Start a new process for this session
-    input_queue = mp.Queue()
-    output_queue = mp.Queue()
-    shutdown_queue = mp.Queue()
-    worker = SessionWorker(data_id, path, gdrive_file_info, input_queue,
-                           output_queue, shutdown_queue, subsets_from_db, math_vars)
-    worker.start()
+    # Get a process for this session, pre-started and warmed up if the pool has one ready.
+    worker_data = worker_pool.get_worker_pool().take(data_id, path, gdrive_file_info, subsets_from_db, math_vars, follow)
+
+    # Routes replies from the worker back to whichever request they answer.
+    dispatcher = ResponseDispatcher(data_id, worker_data['input'], worker_data['output'], worker_data['process'])
+    dispatcher.start()
+
+    # Keeps the latest loading progress so progress requests don't go to the worker.
+    progress = ProgressRelay(data_id, worker_data['process'].progress_queue, worker_data['process'])
+    progress.start()
+
     process_data = {
-        'process': worker,
-        'input': input_queue,
-        'output': output_queue,
+        'process': worker_data['process'],
+        'input': worker_data['input'],
+        'output': worker_data['output'],
+        'dispatcher': dispatcher,
+        'progress': progress,
         'path': path,
-        'shutdown': shutdown_queue,
+        'shutdown': worker_data['shutdown'],
     }
     with g_process_lock:
         g_processes[data_id] = process_data
@@ -129,19 +188,20 @@ def cloud_files():
     return json.dumps(out)
 
 def files_in_folder(dir):
-    csvfiles = []
+    datafiles = []
 
-    for file in glob.glob(dir + "/*.csv"):
-        csvfiles.append(file)
+    for ext in api_utils.table_extensions:
+        for file in glob.glob(dir + "/*" + ext):
+            datafiles.append(file)
 
-    csvfiles.sort(key=str.lower)
+    datafiles.sort(key=str.lower)
 
     out = []
     # Get data for the files
-    for csv in csvfiles:
-        if os.path.isfile(csv):
-            size = os.path.getsize(csv)
-            out.append([os.path.basename(csv), get_filename_from_uuid_filename(os.path.basename(csv)), size])
+    for datafile in datafiles:
+        if os.path.isfile(datafile):
+            size = os.path.getsize(datafile)
+            out.append([os.path.basename(datafile), get_filename_from_uuid_filename(os.path.basename(datafile)), size])
 
     return json.dumps(out)
 
@@ -165,7 +225,8 @@ def load_recent_file():
     if not os.path.exists(f):
         return json.dumps({'error': 'File "' + filename + '" not found.'})
 
-    data_id = load_data(f)
+    # Follow mode: keep adding rows that are appended to the file.
+    data_id = load_data(f, follow=api_utils.get_boolp(data, 'follow'))
 
     return json.dumps({'data_id': data_id})
 
@@ -188,7 +249,8 @@ def load_external_file():
     if not os.path.exists(f):
         return json.dumps({'error': 'File "' + filename + '" not found.'})
 
-    data_id = load_data(f)
+    # Follow mode: keep adding rows that are appended to the file.
+    data_id = load_data(f, follow=api_utils.get_boolp(data, 'follow'))
 
     return json.dumps({'data_id': data_id})
 
@@ -6,6 +6,286 @@ from . import api_utils
 import anndata
 from .anndata_shim import AnndataShim
 import traceback
+import io
+import time
+from .column_buffers import ColumnBuffers
+from . import parsed_cache
+from . import plotplot_config
+from . import admission
+from . import compressed_input
+from .math_restore import MathRestore
+from .column_stats import ColumnStats
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow
+    import pyarrow.csv as pyarrow_csv
+    import pyarrow.parquet as pyarrow_parquet
+    import pyarrow.feather as pyarrow_feather
+except ImportError:
+    pyarrow = None
+
+# CSVs are parsed in chunks of about this many bytes (scaled with the file size, so big files still get
+# enough progress updates without being split into lots of tiny DataFrames).
+min_chunk_bytes = 4 * 1024 * 1024
+max_chunk_bytes = 64 * 1024 * 1024
+progress_updates_per_file = 200
+
+# How much of the file to look at to estimate the bytes per row.
+row_size_sample_bytes = 1024 * 1024
+
+
+def get_chunk_bytes(file_size):
+    return min(max_chunk_bytes, max(min_chunk_bytes, file_size // progress_updates_per_file))
+
+
+def get_bytes_per_row(f):
+    """ Average row size at the start of the file. """
+    sample = f.read(row_size_sample_bytes)
+    f.seek(0)
+    return len(sample) / max(1, sample.count(b'\n'))
+
+
+def use_arrow_csv():
+    return pyarrow is not None and plotplot_config.get_boolean_with_default('performance', 'arrow_csv', True)
+
+
+def find_row_end(data):
+    """ Index of the last newline in data that ends a row (isn't inside a quoted field), or -1.
+        data has to start at the start of a row. """
+    # An odd number of quotes before a newline means it is inside a quoted value.
+    end = data.rfind(b'\n')
+    while end >= 0 and data.count(b'"', 0, end) % 2 == 1:
+        end = data.rfind(b'\n', 0, end)
+    return end
+
+
+def read_row_blocks(f, block_bytes):
+    """ Yields pieces of the file of about block_bytes that end on a row boundary (a newline that is
+        not inside a quoted field), so each can be parsed on its own. """
+    rest = b''
+    while True:
+        data = f.read(block_bytes)
+        if len(data) < 1:
+            if len(rest) > 0:
+                yield rest
+            return
+        data = rest + data
+
+        end = find_row_end(data)
+        if end < 0:
+            rest = data
+            continue
+        yield data[:end + 1]
+        rest = data[end + 1:]
+
+
+def use_progressive_loading():
+    return plotplot_config.get_boolean_with_default('performance', 'progressive_loading', True)
+
+
+# While a file is loading, how often the rows read so far are handed to the session for plotting.
+partial_snapshot_seconds = 1.0
+
+
+# In follow mode, how often to check the file for new rows.
+follow_poll_seconds = 2.0
+
+
+def last_line_end(path):
+    """ Size of the file up to and including its last newline, so a row that is still being written
+        isn't read. """
+    step = 64 * 1024
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - step)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+class LimitedReader():
+    """ Reads a binary file as if it ended after limit bytes. """
+
+    def __init__(self, f, limit):
+        self.f = f
+        self.limit = limit
+
+    def read(self, size=-1):
+        remaining = max(0, self.limit - self.f.tell())
+        return self.f.read(remaining if size < 0 else min(size, remaining))
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def __iter__(self):
+        return iter(self.read().splitlines(keepends=True))
+
+
+def use_dtype_compaction():
+    return plotplot_config.get_boolean_with_default('performance', 'compact_dtypes', False)
+
+
+# Float columns are checked this many values at a time, so one that doesn't fit stops early.
+float32_check_chunk = 1000000
+
+# String columns with at most this fraction of unique values become categoricals.
+max_categorical_unique_fraction = 0.5
+
+
+# Powers of ten that are exact as float64, for float32_exact.
+exact_powers_of_ten = np.array([float(10**k) for k in range(23)])
+
+
+def float32_exact(as_float32, values):
+    """ True if each value is what its float32 reads back as: the float32, rounded to 7 significant
+        digits, is the value the CSV had.  True when the CSV had at most ~7 significant digits. """
+    widened = as_float32.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        shift = 6 - np.floor(np.log10(np.abs(widened)))
+    # Zero, NaN and infinity are held exactly.  Scaling outside 1e+-22 isn't exact, so those few
+    # values are checked by printing them instead.
+    scalable = np.abs(shift) <= 22
+    special = ~np.isfinite(widened) | (widened == 0)
+    shift = np.where(scalable, shift, 0).astype(np.int64)
+    scale = exact_powers_of_ten[np.abs(shift)]
+    # Dividing or multiplying a whole number by an exact power of ten rounds like parsing the decimal.
+    up = shift >= 0
+    rounded = np.round(np.where(up, widened * scale, widened / scale))
+    rounded = np.where(up, rounded / scale, rounded * scale)
+
+    exact = special | (scalable & (rounded == values))
+    rest = ~scalable & ~special
+    if rest.any():
+        exact[rest] = as_float32[rest].astype(str).astype(np.float64) == values[rest]
+    return bool(exact.all())
+
+
+def compact_float(values):
+    """ float32 copy of values if no value has more digits than float32 can hold, else None. """
+    as_float32 = values.astype(np.float32)
+    if not np.array_equal(np.isfinite(as_float32), np.isfinite(values)):
+        # Out of float32's range.
+        return None
+
+    # Every value is checked: one outside a sample would silently lose precision.  A strided sample
+    # first, so most columns that don't fit are rejected quickly.
+    stride = max(1, len(values) // 10000)
+    if not float32_exact(as_float32[::stride], values[::stride]):
+        return None
+    for start in range(0, len(values), float32_check_chunk):
+        end = start + float32_check_chunk
+        if not float32_exact(as_float32[start:end], values[start:end]):
+            return None
+    return as_float32
+
+
+def compact_int(values):
+    """ values in the smallest integer type that holds them, or None if that's what they're in. """
+    if len(values) < 1:
+        return None
+    vmin = values.min()
+    vmax = values.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= vmin and vmax <= info.max:
+            return values.astype(dtype) if np.dtype(dtype).itemsize < values.dtype.itemsize else None
+    return None
+
+
+def compact_strings(series):
+    """ series as a categorical if it's all strings with lots of repeats, else None. """
+    if len(series) < 1:
+        return None
+    num_unique = series.nunique()
+    if num_unique > len(series) * max_categorical_unique_fraction:
+        return None
+    if not series.dropna().map(type).eq(str).all():
+        return None
+    return series.astype('category')
+
+
+def compact_dtypes(df):
+    """ Shrinks df's columns in place without losing information: float32 for floats that fit,
+        narrow ints, and categoricals for repetitive string columns.  Prints a per-column report. """
+    report = []
+    for name in df.columns:
+        series = df[name]
+        kind = series.dtype.kind
+        if kind == 'f':
+            new_values = compact_float(series.to_numpy())
+        elif kind == 'i':
+            new_values = compact_int(series.to_numpy())
+        elif kind == 'O':
+            new_values = compact_strings(series)
+        else:
+            new_values = None
+        if new_values is None:
+            continue
+
+        bytes_before = series.memory_usage(index=False, deep=True)
+        df[name] = new_values
+        bytes_after = df[name].memory_usage(index=False, deep=True)
+        report.append((name, series.dtype, df[name].dtype, bytes_before, bytes_after))
+
+    total_before = sum(r[3] for r in report)
+    total_after = sum(r[4] for r in report)
+    print(f'Compacted {len(report)} columns: {total_before / 1e6:.1f} MB -> {total_after / 1e6:.1f} MB')
+    for name, dtype_before, dtype_after, bytes_before, bytes_after in report:
+        print(f'    {name}: {dtype_before} -> {dtype_after} ({bytes_before / 1e6:.1f} MB -> {bytes_after / 1e6:.1f} MB)')
+    return report
+
+
+def arrow_column_to_numpy(column):
+    """ Converts a parsed column the way pandas would have read it: missing values are NaN. """
+    if pyarrow.types.is_null(column.type):
+        return np.full(len(column), np.nan)
+    values = column.to_numpy(zero_copy_only=False)
+    if values.dtype == object and column.null_count > 0:
+        values[~column.is_valid().to_numpy(zero_copy_only=False)] = np.nan
+    return values
+
+
+def require_pyarrow(file_type):
+    if pyarrow is None:
+        raise Exception(f'Reading {file_type} files needs pyarrow: pip install "plotplot[arrow]"')
+
+
+def is_plottable_arrow_type(arrow_type):
+    """ False for columns that can't be shown as a plotplot column (lists, structs, binary blobs). """
+    return not (pyarrow.types.is_nested(arrow_type) or pyarrow.types.is_binary(arrow_type)
+                or pyarrow.types.is_large_binary(arrow_type) or pyarrow.types.is_fixed_size_binary(arrow_type))
+
+
+def plottable_column(column):
+    """ Converts a Parquet/Arrow column to a type arrow_column_to_numpy reads the way the same data
+        in a CSV would be read: dates and times as strings, decimals as floats, dictionaries decoded. """
+    if pyarrow.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    if pyarrow.types.is_duration(column.type):
+        column = column.cast(pyarrow.int64())
+    elif pyarrow.types.is_temporal(column.type):
+        column = column.cast(pyarrow.string())
+    elif pyarrow.types.is_decimal(column.type):
+        column = column.cast(pyarrow.float64())
+    return column
+
+
+def plottable_column_names(schema):
+    names = [field.name for field in schema if is_plottable_arrow_type(field.type)]
+    skipped = [field.name for field in schema if not is_plottable_arrow_type(field.type)]
+    if len(skipped) > 0:
+        print(f'Not loading {len(skipped)} columns with types that can\'t be plotted: {skipped}')
+    return names
+
 
 class LoadCsvThread(threading.Thread):
 
@@ -15,7 +295,9 @@ class LoadCsvThread(threading.Thread):
                  subsets_from_db,
                  data,
                  data_lock,
+                 data_rw_lock,
                  math_vars,
+                 follow_progress=None,
                  args=(),
                  kwargs=None):
         threading.Thread.__init__(self, args=(), kwargs=None)
@@ -26,6 +308,383 @@ class LoadCsvThread(threading.Thread):
         self.daemon = True
         self.data = data
         self.data_lock = data_lock
+        self.data_rw_lock = data_rw_lock
+        self.progressive = use_progressive_loading()
+        self.last_snapshot_time = 0
+        # Set once the session has data to plot, so the UI can open before loading finishes.
+        self.partial_published = False
+        # Follow mode (see follow_file) if set.  Gets an update each time rows are appended.
+        self.follow_progress = follow_progress
+        # While following: the column buffers of the data, the subset masks (and the Series handed to
+        # the session for each), and how much of the file has been read.
+        self.buffers = None
+        self.subset_buffers = None
+        self.subset_series = {}
+        self.follow_offset = None
+        # Set if the file was read in wide-table mode.
+        self.wide = False
+
+    def read_csv(self, math_vars_len):
+        # Progress comes from how far into the file the parser has read, so the file is only read
+        # once.  The row total is an estimate until the end.  For compressed files that's the
+        # position in the compressed file.
+        total_bytes = max(1, os.path.getsize(self.path))
+
+        with compressed_input.open_input(self.path) as f:
+            follow = self.follow_progress is not None and not isinstance(f, compressed_input.DecompressingReader)
+            if follow:
+                # Only whole rows.  One that is being written now is read with the next new rows.
+                follow_end = last_line_end(self.path)
+                total_bytes = max(1, follow_end)
+                f = LimitedReader(f, follow_end)
+
+            bytes_per_row = get_bytes_per_row(f)
+            data_bytes = total_bytes
+            if isinstance(f, compressed_input.DecompressingReader):
+                data_bytes = total_bytes * f.compression_ratio()
+            chunk_bytes = get_chunk_bytes(data_bytes)
+            expected_rows = data_bytes / bytes_per_row * 1.05
+
+            # Wide tables are written straight into the parsed cache as they are parsed and then
+            # memory-mapped, so only the columns a session actually uses end up in memory.
+            num_columns = len(pd.read_csv(f, nrows=0, index_col=False).columns)
+            f.seek(0)
+            # Followed files are kept in memory so rows can be appended.
+            wide = not follow and parsed_cache.is_enabled() and 0 < parsed_cache.get_wide_table_columns() <= num_columns
+            if wide:
+                print(f'{num_columns} columns, reading in wide-table mode.')
+                self.wide = True
+
+            def new_buffers():
+                return parsed_cache.EntryWriter(self.path) if wide else ColumnBuffers(expected_rows)
+
+            buffers = None
+            try:
+                if use_arrow_csv():
+                    try:
+                        buffers = new_buffers()
+                        self.read_csv_arrow(f, buffers, chunk_bytes, total_bytes, math_vars_len)
+                    except pyarrow.ArrowInvalid as e:
+                        print(f'Multi-threaded CSV parse failed, using pandas instead: {e}')
+                        if wide:
+                            buffers.abort()
+                        buffers = None
+                        f.seek(0)
+
+                if buffers is None:
+                    buffers = new_buffers()
+                    self.read_csv_pandas(f, buffers, max(1024, int(chunk_bytes / bytes_per_row)), total_bytes, math_vars_len)
+            except BaseException:
+                if wide and buffers is not None:
+                    buffers.abort()
+                raise
+
+        if wide:
+            # Already memory-mapped, so compaction would only load it into memory.  Pinned so no
+            # session evicts the entry before it is open.
+            with parsed_cache.pinned(buffers.key):
+                if not buffers.finish():
+                    print(f'Opening the parsed cache entry another session stored for {self.path}.')
+                df = parsed_cache.load(self.path)
+            if df is None:
+                raise Exception(f'Could not open {self.path} from the parsed cache after reading it.')
+            return df
+
+        if follow:
+            self.buffers = buffers
+            self.follow_offset = follow_end
+            # Keeps the spare capacity for appended rows, and the dtypes they're parsed with.
+            return buffers.view()
+
+        df = buffers.to_dataframe()
+        self.compact(df, math_vars_len)
+        return df
+
+    def compact(self, df, math_vars_len):
+        if not use_dtype_compaction():
+            return
+        self.progress_queue.put({
+            'progress': 1,
+            'rows_loaded': len(df),
+            'total_rows': len(df),
+            'math_vars_loaded': 0,
+            'math_vars_total': math_vars_len,
+            'text': 'Compacting columns...',
+        })
+        compact_dtypes(df)
+
+    def read_csv_pandas(self, f, buffers, chunksize, total_bytes, math_vars_len):
+        reader = pd.read_csv(f, chunksize=chunksize, index_col=False)
+        for chunk in reader:
+            buffers.append({name: chunk[name].to_numpy() for name in chunk.columns})
+            self.publish_partial(buffers, f.tell() / total_bytes)
+            self.put_parse_progress(buffers.num_rows, f.tell(), total_bytes, math_vars_len)
+
+    def read_csv_arrow(self, f, buffers, chunk_bytes, total_bytes, math_vars_len):
+        """ Parses the file in blocks with pyarrow, which uses all cores on each block.  Raises
+            ArrowInvalid for anything it can't read the same way pandas would. """
+        names = None
+        # Columns pyarrow would turn into dates or times.  pandas leaves those as strings.
+        string_columns = {}
+        for block in read_row_blocks(f, chunk_bytes):
+            read_options = pyarrow_csv.ReadOptions(use_threads=True, column_names=names)
+            while True:
+                convert_options = pyarrow_csv.ConvertOptions(strings_can_be_null=True, column_types=string_columns)
+                table = pyarrow_csv.read_csv(io.BytesIO(block), read_options=read_options, convert_options=convert_options)
+                other_types = {field.name: pyarrow.string() for field in table.schema
+                               if not (pyarrow.types.is_integer(field.type) or pyarrow.types.is_floating(field.type)
+                                       or pyarrow.types.is_boolean(field.type) or pyarrow.types.is_string(field.type)
+                                       or pyarrow.types.is_null(field.type))}
+                if len(other_types) < 1:
+                    break
+                string_columns.update(other_types)
+
+            if names is None:
+                names = table.schema.names
+                if len(set(names)) != len(names) or '' in names:
+                    # pandas renames these ("a.1", "Unnamed: 0"), let it do that.
+                    raise pyarrow.ArrowInvalid('Duplicate or empty column names.')
+
+            buffers.append({name: arrow_column_to_numpy(table.column(i)) for i, name in enumerate(names)})
+            del table
+            self.publish_partial(buffers, f.tell() / total_bytes)
+            self.put_parse_progress(buffers.num_rows, f.tell(), total_bytes, math_vars_len)
+
+    def put_parse_progress(self, rows_read, bytes_read, total_bytes, math_vars_len):
+        completed = min(1.0, float(bytes_read) / total_bytes)
+        self.progress_queue.put({
+            'progress': completed,
+            'rows_loaded': rows_read,
+            'total_rows': int(rows_read / max(completed, 1e-9)),
+            'bytes_loaded': bytes_read,
+            'total_bytes': total_bytes,
+            'math_vars_loaded': 0,
+            'math_vars_total': math_vars_len,
+            'text': 'Parsing CSV...',
+            'partial': self.partial_published,
+        })
+
+    def read_parquet(self, math_vars_len):
+        """ Reads the row groups on a thread pool, appending them in file order.  Only the columns
+            plotplot can use are read. """
+        require_pyarrow('Parquet')
+        parquet_file = pyarrow_parquet.ParquetFile(self.path)
+        num_row_groups = parquet_file.metadata.num_row_groups
+        total_rows = parquet_file.metadata.num_rows
+        names = plottable_column_names(parquet_file.schema_arrow)
+        num_threads = admission.get_worker_threads()
+
+        # ParquetFile isn't safe to share between threads, so each gets its own.
+        thread_state = threading.local()
+
+        def read_row_group(i):
+            if not hasattr(thread_state, 'parquet_file'):
+                thread_state.parquet_file = pyarrow_parquet.ParquetFile(self.path)
+            # With fewer row groups than threads, let pyarrow read each row group's columns in parallel.
+            return thread_state.parquet_file.read_row_group(i, columns=names, use_threads=num_row_groups < num_threads)
+
+        buffers = ColumnBuffers(total_rows)
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            # A few row groups ahead of the one being appended, so memory use stays bounded.
+            pending = deque()
+            next_row_group = 0
+            while next_row_group < num_row_groups or len(pending) > 0:
+                while next_row_group < num_row_groups and len(pending) < 2 * num_threads:
+                    pending.append(executor.submit(read_row_group, next_row_group))
+                    next_row_group += 1
+                table = pending.popleft().result()
+                buffers.append({name: arrow_column_to_numpy(plottable_column(table.column(name))) for name in names})
+                del table
+                self.publish_partial(buffers, buffers.num_rows / max(1, total_rows))
+                self.put_read_progress(buffers.num_rows / max(1, total_rows), buffers.num_rows, total_rows, math_vars_len, 'Reading Parquet...')
+
+        df = buffers.to_dataframe()
+        self.compact(df, math_vars_len)
+        return df
+
+    def read_arrow_ipc(self, math_vars_len):
+        """ Memory-maps a Feather/Arrow IPC file.  Uncompressed numeric columns without missing values
+            (in a single record batch) are used in place, so they're paged in from disk as they're used
+            instead of being read up front. """
+        require_pyarrow('Feather/Arrow')
+        try:
+            table = pyarrow.ipc.open_file(pyarrow.memory_map(self.path)).read_all()
+        except pyarrow.ArrowInvalid:
+            # Feather V1
+            table = pyarrow_feather.read_table(self.path, memory_map=True)
+
+        names = plottable_column_names(table.schema)
+        columns = {}
+        for i, name in enumerate(names):
+            column = plottable_column(table.column(name))
+            if column.num_chunks == 1:
+                columns[name] = arrow_column_to_numpy(column.chunk(0))
+            else:
+                columns[name] = arrow_column_to_numpy(column)
+            self.put_read_progress((i + 1) / len(names), table.num_rows, table.num_rows, math_vars_len, 'Mapping columns...')
+
+        # Already memory-mapped, so compaction would only load it into memory.
+        return pd.DataFrame(columns, copy=False)
+
+    def put_read_progress(self, completed, rows_read, total_rows, math_vars_len, text):
+        self.progress_queue.put({
+            'progress': completed,
+            'rows_loaded': rows_read,
+            'total_rows': total_rows,
+            'math_vars_loaded': 0,
+            'math_vars_total': math_vars_len,
+            'text': text,
+            'partial': self.partial_published,
+        })
+
+    def make_subsets(self, num_rows):
+        """ "(all)" and the subsets restored from the database, for the first num_rows rows. """
+        subsets = {
+            0: {
+                'idx': pd.Series(np.ones(num_rows, dtype=bool)),
+                'count': num_rows,
+            }
+        }
+        if self.subsets_from_db is not None:
+            for key, subset in self.subsets_from_db.items():
+                if len(subset['idx']) > num_rows:
+                    idx = subset['idx'][:num_rows]
+                    subset = {'idx': idx, 'count': int(np.sum(idx))}
+                elif len(subset['idx']) < num_rows:
+                    # The file has grown since the subset was made (see follow_file).
+                    idx = np.zeros(num_rows, dtype=bool)
+                    idx[:len(subset['idx'])] = subset['idx']
+                    subset = {'idx': pd.Series(idx), 'count': subset['count']}
+                subsets[key] = subset
+
+        subset_counter = 0
+        for key in subsets:
+            subset_counter = max(subset_counter, key)
+        subset_counter += 1
+        return subsets, subset_counter
+
+    def publish_partial(self, buffers, completed):
+        """ Lets the session plot the rows read so far, at most every partial_snapshot_seconds.  If
+            requests are using the current snapshot, this one is skipped rather than waiting. """
+        if not self.progressive or not isinstance(buffers, ColumnBuffers):
+            return
+        if time.time() - self.last_snapshot_time < partial_snapshot_seconds:
+            return
+        if not self.data_rw_lock.try_acquire_write():
+            return
+        try:
+            df = buffers.view()
+            self.set_data(df, None, [], {
+                'rows_loaded': len(df),
+                'total_rows': int(len(df) / max(completed, 1e-9)),
+            })
+        finally:
+            self.data_rw_lock.release_write()
+        self.last_snapshot_time = time.time()
+        self.partial_published = True
+
+    def set_data(self, df, col_labels, math_vars, partial, math_restore=None, column_stats=None):
+        """ Hands df to the session.  partial is None for the finished data, writers are refused until
+            then.  Call with data_rw_lock held for writing. """
+        subsets, subset_counter = self.make_subsets(len(df))
+        with self.data_lock:
+            self.data['df'] = df
+            self.data['col_labels'] = col_labels
+            self.data['subsets'] = subsets
+            self.data['subset_counter'] = subset_counter
+            self.data['path'] = self.path
+            self.data['math_vars'] = math_vars
+            self.data['partial'] = partial
+            self.data['math_restore'] = math_restore
+            self.data['column_stats'] = column_stats
+
+    def follow_file(self):
+        """ Follow mode: watches the file and appends the rows written to it since it was loaded.
+            Only the new bytes are parsed and the columns and subset masks are extended in place, so a
+            refresh costs about as much as the new rows. """
+        print(f'Following {self.path} for new rows.')
+        names = list(self.buffers.columns)
+        while True:
+            time.sleep(follow_poll_seconds)
+            try:
+                size = os.path.getsize(self.path)
+            except OSError as e:
+                print(f'Stopped following {self.path}: {e}')
+                break
+            if size < self.follow_offset:
+                print(f'Stopped following {self.path}, it got shorter.')
+                break
+
+            while self.follow_offset < size:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.follow_offset)
+                    data = f.read(min(size - self.follow_offset, max_chunk_bytes))
+                end = find_row_end(data)
+                if end < 0:
+                    # Only part of a row so far.
+                    break
+                block = pd.read_csv(io.BytesIO(data[:end + 1]), header=None, names=names, index_col=False)
+                self.follow_offset += end + 1
+                if len(block) > 0:
+                    self.append_rows(block)
+
+        self.follow_progress.put({'rows': self.buffers.num_rows, 'stopped': True})
+
+    def append_rows(self, block):
+        """ Adds newly parsed rows to the session's data.  Math variables are computed for just these
+            rows, and the new rows join "(all)" but no other subset. """
+        self.data_rw_lock.acquire_write()
+        try:
+            with self.data_lock:
+                df = self.data['df']
+                subsets = self.data['subsets']
+                math_vars = self.data['math_vars']
+
+            for packed_math_var in math_vars:
+                expr = api_utils.unpack_math_var(packed_math_var)['expr']
+                name = api_utils.math_var_column_name(expr)
+                if name not in df.columns:
+                    # Not restored yet, it will be computed for all the rows.
+                    continue
+                math_out = api_utils.do_math_helper(block, [], expr)
+                block[name] = np.nan if 'error' in math_out else math_out['new_col']
+                if name not in self.buffers.columns:
+                    # Added since the last refresh.
+                    self.buffers.add_column(name, df[name].to_numpy())
+            new_rows = {name: block[name].to_numpy() for name in block.columns}
+            self.buffers.append(new_rows)
+            with self.data_lock:
+                column_stats = self.data['column_stats']
+            if column_stats is not None:
+                column_stats.append(new_rows)
+
+            # The subset masks get the same treatment as the columns.
+            if self.subset_buffers is None:
+                self.subset_buffers = ColumnBuffers(self.buffers.capacity)
+                self.subset_buffers.append({key: subset['idx'].to_numpy() for key, subset in subsets.items()})
+                self.subset_series = {key: subset['idx'] for key, subset in subsets.items()}
+            for key in list(self.subset_buffers.columns):
+                if key not in subsets:
+                    self.subset_buffers.drop(key)
+            for key, subset in subsets.items():
+                if self.subset_series.get(key) is not subset['idx']:
+                    # Made (or replaced) since the last refresh.
+                    self.subset_buffers.add_column(key, subset['idx'].to_numpy())
+            self.subset_buffers.append({key: np.full(len(block), key == 0) for key in subsets})
+
+            num_rows = self.subset_buffers.num_rows
+            with self.data_lock:
+                self.data['df'] = self.buffers.view()
+                for key, subset in subsets.items():
+                    subsets[key] = dict(subset)
+                    subsets[key]['idx'] = pd.Series(self.subset_buffers.columns[key][:num_rows], copy=False)
+                    subsets[key]['count'] = subset['count'] + (len(block) if key == 0 else 0)
+                    self.subset_series[key] = subsets[key]['idx']
+        finally:
+            self.data_rw_lock.release_write()
+
+        print(f'Appended {len(block)} rows from {self.path}.')
+        self.follow_progress.put({'rows': self.buffers.num_rows, 'stopped': False})
 
     def run(self):
         try:
@@ -109,80 +768,33 @@ class LoadCsvThread(threading.Thread):
                     'math_vars_total': math_vars_len,
                     'text': 'Opening file...',
                 })
-                lines_number = sum(1 for line in open(self.path))
-                self.progress_queue.put({
-                    'progress': 0,
-                    'rows_loaded': 0,
-                    'total_rows': lines_number,
-                    'math_vars_loaded': None,
-                    'math_vars_total': None,
-                    'text': 'Loading file data...',
-                })
-
-                chunksize = 8192  # I don't know what size is better
-                lines_read = 0
+                if ext.lower() in api_utils.parquet_extensions:
+                    df = self.read_parquet(math_vars_len)
+                elif ext.lower() in api_utils.arrow_ipc_extensions:
+                    df = self.read_arrow_ipc(math_vars_len)
+                elif self.follow_progress is not None:
+                    # Not from the parsed cache: new rows are appended to the buffers it's read into.
+                    df = self.read_csv(math_vars_len)
+                else:
+                    df = parsed_cache.load(self.path)
+                    if df is None:
+                        df = self.read_csv(math_vars_len)
+                        parsed_cache.store_in_background(self.path, df)
 
-                reader = pd.read_csv(self.path, chunksize=chunksize, index_col=False)
-                df_list = []
-                for chunk in reader:
-                    lines_read += len(chunk)
-                    df_list.append(chunk)
+                completed = 1.0
+                lines_read = len(df)
+                lines_number = lines_read
 
-                    completed = float(lines_read) / lines_number
-                    self.progress_queue.put({
-                        'progress': completed,
-                        'rows_loaded': lines_read,
-                        'total_rows': lines_number,
-                        'math_vars_loaded': 0,
-                        'math_vars_total': math_vars_len,
-                        'text': 'Parsing CSV...',
-                    })
+            column_stats = None
+            if isinstance(df, pd.DataFrame):
+                column_stats = ColumnStats()
+                if not self.wide:
+                    # Wide tables are memory-mapped, their columns' statistics are computed on first use.
+                    column_stats.build(df, admission.get_worker_threads())
 
-                df = pd.concat(df_list, ignore_index=True)
-
-            subsets = {
-                0: {
-                    'idx': pd.Series(np.ones(len(df), dtype=bool)),
-                    'count': len(df),
-                }
-            }
-            if self.subsets_from_db is not None:
-                subsets = subsets | self.subsets_from_db  # merge dictionaries
-            
-            subset_counter = 0
-            for key in subsets:
-                subset_counter = max(subset_counter, key)
-            subset_counter += 1
-
-            computed_math_vars = []
-            if self.math_vars is not None:
-                for i, packed_math_var in enumerate(self.math_vars):
-                    print('Computing ' + str(packed_math_var))
-                    # Unpack math variable from database.
-                    math_var = api_utils.unpack_math_var(packed_math_var)
-                    
-                    # Compute the variable.
-                    math_out = api_utils.do_math_helper(df, computed_math_vars, math_var['expr'])
-
-                    if 'error' in math_out:
-                        print('Error computing math variable:' + str(math_var))
-                        print(math_out['error'])
-                        continue
-
-                    name_expression = math_out['name']
-                    new_col = math_out['new_col']
-                    computed_math_vars = math_out['math_vars']
-
-                    df[name_expression] = new_col
-
-                    self.progress_queue.put({
-                        'progress': completed,
-                        'rows_loaded': lines_read,
-                        'total_rows': lines_number,
-                        'math_vars_loaded': i+1,
-                        'math_vars_total': math_vars_len,
-                        'text': 'Restoring math variables...',
-                    })
+            # The session doesn't wait for the math variables, see MathRestore.
+            math_vars = [] if self.math_vars is None else list(self.math_vars)
+            math_restore = MathRestore(math_vars, self.data, self.data_lock, self.data_rw_lock)
         except BaseException as e:
             tb = traceback.format_exc()
             print(e)
@@ -190,10 +802,21 @@ class LoadCsvThread(threading.Thread):
             result = dict(error=str(e) + '\n\n' + str(tb))
             self.progress_queue.put(result)
 
-        with self.data_lock:
-            self.data['df'] = df
-            self.data['col_labels'] = col_labels
-            self.data['subsets'] = subsets
-            self.data['subset_counter'] = subset_counter
-            self.data['path'] = self.path
-            self.data['math_vars'] = computed_math_vars
+        self.data_rw_lock.acquire_write()
+        try:
+            self.set_data(df, col_labels, math_vars, None, math_restore, column_stats)
+        finally:
+            self.data_rw_lock.release_write()
+
+        self.progress_queue.put({
+            'progress': 1,
+            'rows_loaded': None,
+            'total_rows': None,
+            'done': True,
+            'following': self.follow_offset is not None,
+        })
+
+        math_restore.restore()
+
+        if self.follow_offset is not None:
+            self.follow_file()
@@ -0,0 +1,149 @@
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from . import admission
+from . import api_utils
+
+
+# Request arguments that hold column names, directly or as a list.
+column_keys = {'x', 'y', 'z', 'colx', 'coly', 'colz', 'column', 'hoverlist', 'filter_var'}
+
+
+def mentioned_names(args):
+    """ The columns a request's arguments name, plus the columns used by any math expression among
+        them. """
+    names = set()
+    stack = [args]
+    while len(stack) > 0:
+        value = stack.pop()
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key in column_keys:
+                    items = item if isinstance(item, (list, tuple)) else [item]
+                    names.update(name for name in items if isinstance(name, str))
+                elif key == 'expr' and isinstance(item, str):
+                    names |= api_utils.math_var_refs(item)
+                else:
+                    stack.append(item)
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return names
+
+
+class MathRestore():
+    """ Restores a resumed session's math variables.  The session can be used as soon as its file is
+        loaded: the columns are computed in the background, and a request that uses one that isn't
+        there yet restores it (and the columns it is computed from) first.
+
+        Expressions are evaluated a dependency level at a time, those in a level in parallel, and each
+        level's columns are added to the DataFrame together. """
+
+    def __init__(self, math_vars, data, data_lock, data_rw_lock):
+        self.data = data
+        self.data_lock = data_lock
+        self.data_rw_lock = data_rw_lock
+        # Held while restoring, so a column is only computed once.
+        self.lock = threading.Lock()
+
+        self.exprs = {}  # column name -> expression
+        for packed_math_var in math_vars:
+            expr = api_utils.unpack_math_var(packed_math_var)['expr']
+            self.exprs[api_utils.math_var_column_name(expr)] = expr
+        # Replaced, never changed, so it can be read without the lock.
+        self.pending_columns = frozenset(self.exprs)
+
+    def pending_in(self, args):
+        """ The columns a request uses that haven't been restored yet. """
+        pending = self.pending_columns
+        if len(pending) < 1:
+            return set()
+        return pending & mentioned_names(args)
+
+    def restore(self, names=None):
+        """ Restores the given columns, or all of them, and the columns they are computed from. """
+        with ThreadPoolExecutor(max_workers=admission.get_worker_threads()) as executor:
+            while True:
+                # A level at a time, so a request's columns can be restored between the background's.
+                with self.lock:
+                    needed = self.with_dependencies(self.pending_columns if names is None else names)
+                    if len(needed) < 1:
+                        return
+                    level = self.levels(needed)[0]
+                    print(f'Restoring math variables: {", ".join(level)}')
+                    self.restore_level(level, executor)
+
+    def with_dependencies(self, names):
+        needed = set()
+        stack = [name for name in names if name in self.pending_columns]
+        while len(stack) > 0:
+            name = stack.pop()
+            if name in needed:
+                continue
+            needed.add(name)
+            stack.extend(ref for ref in api_utils.math_var_refs(self.exprs[name]) if ref in self.pending_columns)
+        return needed
+
+    def levels(self, needed):
+        """ Splits the columns into levels that only use columns from earlier levels. """
+        deps = {name: api_utils.math_var_refs(self.exprs[name]) & needed for name in needed}
+        levels = []
+        done = set()
+        while len(done) < len(needed):
+            level = [name for name in needed if name not in done and deps[name] <= done]
+            if len(level) < 1:
+                # A cycle.  Evaluating the rest reports the missing columns as errors.
+                level = [name for name in needed if name not in done]
+            levels.append(level)
+            done.update(level)
+        return levels
+
+    def evaluate(self, df, name):
+        math_out = api_utils.do_math_helper(df, [], self.exprs[name])
+        if 'error' in math_out:
+            print(f'Error computing math variable {name}: {math_out["error"]}')
+            return None
+        return math_out['new_col']
+
+    def restore_level(self, level, executor):
+        while True:
+            # Computed under the read lock, so plots can run alongside.
+            self.data_rw_lock.acquire_read()
+            try:
+                with self.data_lock:
+                    df = self.data['df']
+                if len(level) == 1:
+                    results = [self.evaluate(df, level[0])]
+                else:
+                    results = list(executor.map(lambda name: self.evaluate(df, name), level))
+            finally:
+                self.data_rw_lock.release_read()
+
+            self.data_rw_lock.acquire_write()
+            try:
+                with self.data_lock:
+                    if self.data['df'] is not df:
+                        # Rows were appended meanwhile (follow mode), compute again.
+                        continue
+                    new_cols = {name: col for name, col in zip(level, results)
+                                if col is not None and name not in df.columns}
+                    if not isinstance(df, pd.DataFrame):
+                        # AnndataShim, which adds columns in place.
+                        for name, col in new_cols.items():
+                            df[name] = col
+                    elif len(new_cols) > 0:
+                        # One insert for the level instead of one per column.
+                        new_df = pd.DataFrame(new_cols, index=df.index)
+                        self.data['df'] = pd.concat([df, new_df], axis=1, copy=False)
+                        if self.data.get('column_stats') is not None:
+                            for name in new_cols:
+                                self.data['column_stats'].add(name, new_df[name])
+                    failed = {name for name, col in zip(level, results) if col is None}
+                    if len(failed) > 0:
+                        self.data['math_vars'] = [
+                            packed_math_var for packed_math_var in self.data['math_vars']
+                            if api_utils.math_var_column_name(api_utils.unpack_math_var(packed_math_var)['expr']) not in failed
+                        ]
+                    self.pending_columns = self.pending_columns - set(level)
+                    return
+            finally:
+                self.data_rw_lock.release_write()
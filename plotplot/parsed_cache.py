@@ -0,0 +1,329 @@
+import os
+import json
+import uuid
+import shutil
+import pickle
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from . import plotplot_config
+
+try:
+    import pyarrow
+    import pyarrow.feather as pyarrow_feather
+except ImportError:
+    pyarrow = None
+
+# Parsed CSVs are kept here, one directory per file version, so loading the same file again (a recent
+# file, a resumed session) maps the columns straight from disk instead of parsing the CSV.
+#
+# Each entry has a manifest.json and one file per column: numeric and bool columns as raw arrays that
+# are memory-mapped on load, other columns (strings, categoricals) as Feather files.  Without pyarrow,
+# or for a column of mixed types Arrow can't hold, they are pickled.
+manifest_version = 1
+
+# Entries still being written (or pinned) after this long were left by a session that died.
+stale_seconds = 24 * 3600
+
+
+def get_cache_dir():
+    return os.path.join(plotplot_config.get_upload_dir(), 'parsed_cache')
+
+
+def get_max_bytes():
+    return plotplot_config.get_int_with_default('performance', 'parsed_cache_size_gb', 10) * 1024**3
+
+
+def is_enabled():
+    return get_max_bytes() > 0
+
+
+def get_wide_table_columns():
+    """ Files with at least this many columns are read in wide-table mode (see LoadCsvThread). """
+    return plotplot_config.get_int_with_default('performance', 'wide_table_columns', 500)
+
+
+def get_key(path):
+    """ Changes whenever the file does. """
+    st = os.stat(path)
+    # Compacted and full-size columns are cached separately.
+    compact = plotplot_config.get_boolean_with_default('performance', 'compact_dtypes', False)
+    key = f'{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{compact}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def load(path):
+    """ Returns the cached DataFrame for this file, or None. """
+    if not is_enabled():
+        return None
+
+    entry_dir = os.path.join(get_cache_dir(), get_key(path))
+    manifest_path = os.path.join(entry_dir, 'manifest.json')
+    if not os.path.isfile(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['version'] != manifest_version:
+            return None
+
+        columns = {}
+        for col in manifest['columns']:
+            col_path = os.path.join(entry_dir, col['file'])
+            if col['format'] == 'raw':
+                if manifest['rows'] == 0:
+                    columns[col['name']] = np.empty(0, dtype=col['dtype'])
+                else:
+                    # Copy-on-write, so the session can change its copy without touching the cache.
+                    columns[col['name']] = np.memmap(col_path, dtype=col['dtype'], mode='c', shape=(manifest['rows'], ))
+            elif col['format'] == 'feather':
+                columns[col['name']] = read_feather_column(col_path)
+            else:
+                with open(col_path, 'rb') as f:
+                    columns[col['name']] = pickle.load(f)
+    except Exception as e:
+        print(f'Ignoring unreadable parsed cache entry {entry_dir}: {e}')
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+
+    # Mark as recently used for eviction.
+    os.utime(manifest_path)
+    print(f'Loaded {path} from the parsed cache.')
+    return pd.DataFrame(columns, copy=False)
+
+
+def write_feather_column(path, values):
+    """ Returns False if Arrow can't hold the column (mixed types, say). """
+    if pyarrow is None:
+        return False
+    try:
+        table = pyarrow.table({'values': pyarrow.array(values, from_pandas=True)})
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, pyarrow.ArrowNotImplementedError):
+        return False
+    pyarrow_feather.write_feather(table, path, compression='uncompressed')
+    return True
+
+
+def read_feather_column(path):
+    column = pyarrow_feather.read_table(path, memory_map=True).column('values')
+    if pyarrow.types.is_dictionary(column.type):
+        return column.to_pandas().array
+    values = column.to_numpy(zero_copy_only=False)
+    if values.dtype == object and column.null_count > 0:
+        # Missing strings read from a CSV are NaN, not None.
+        values[column.is_null().to_numpy(zero_copy_only=False)] = np.nan
+    return values
+
+
+class EntryWriter():
+    """ Builds a cache entry for a file a block of rows at a time.  Numeric columns are appended to
+        their files on disk as blocks arrive, so only the other columns are held in memory.  Like
+        ColumnBuffers, a column's dtype is widened if a later block needs it. """
+
+    def __init__(self, path):
+        self.path = path
+        self.cache_dir = get_cache_dir()
+        self.key = get_key(path)
+        # Written under a temporary name and renamed, so a half-written entry is never loaded.
+        self.tmp_dir = os.path.join(self.cache_dir, f'{self.key}.tmp-{uuid.uuid4()}')
+        os.makedirs(self.tmp_dir)
+        self.num_rows = 0
+        self.names = []
+        self.raw_dtypes = {}  # name -> dtype of its file on disk
+        self.other = {}  # name -> list of arrays
+
+    def raw_file(self, name):
+        return os.path.join(self.tmp_dir, f'col_{self.names.index(name)}.bin')
+
+    def append(self, block):
+        """ block: dict of column name -> numpy array, all with the same length. """
+        if len(block) < 1:
+            return
+        for name, values in block.items():
+            if name not in self.raw_dtypes and name not in self.other:
+                self.names.append(name)
+                if values.dtype.kind in 'biuf':
+                    self.raw_dtypes[name] = values.dtype
+                else:
+                    self.other[name] = []
+
+            if name in self.raw_dtypes and not np.can_cast(values.dtype, self.raw_dtypes[name], 'safe'):
+                self.widen(name, np.result_type(self.raw_dtypes[name], values.dtype))
+
+            if name in self.raw_dtypes:
+                with open(self.raw_file(name), 'ab') as f:
+                    values.astype(self.raw_dtypes[name], copy=False).tofile(f)
+            else:
+                self.other[name].append(values)
+        self.num_rows += len(next(iter(block.values())))
+
+    def widen(self, name, dtype):
+        values = np.fromfile(self.raw_file(name), dtype=self.raw_dtypes[name])
+        if dtype.kind in 'biuf':
+            values.astype(dtype).tofile(self.raw_file(name))
+            self.raw_dtypes[name] = dtype
+        else:
+            os.remove(self.raw_file(name))
+            del self.raw_dtypes[name]
+            self.other[name] = [values.astype(dtype)]
+
+    def finish(self):
+        """ Writes the manifest and makes the entry visible.  Returns False if it couldn't be. """
+        manifest_columns = []
+        for i, name in enumerate(self.names):
+            if name in self.raw_dtypes:
+                if not os.path.exists(self.raw_file(name)):
+                    open(self.raw_file(name), 'wb').close()
+                manifest_columns.append({'name': name, 'format': 'raw', 'dtype': self.raw_dtypes[name].str, 'file': f'col_{i}.bin'})
+            else:
+                if len(self.other[name]) == 1:
+                    values = self.other[name][0]
+                elif len(self.other[name]) > 1:
+                    values = np.concatenate(self.other[name])
+                else:
+                    values = np.empty(0, dtype=object)
+                file = f'col_{i}.feather'
+                if write_feather_column(os.path.join(self.tmp_dir, file), values):
+                    manifest_columns.append({'name': name, 'format': 'feather', 'file': file})
+                    continue
+                file = f'col_{i}.pickle'
+                with open(os.path.join(self.tmp_dir, file), 'wb') as f:
+                    pickle.dump(values, f, protocol=pickle.HIGHEST_PROTOCOL)
+                manifest_columns.append({'name': name, 'format': 'pickle', 'file': file})
+
+        with open(os.path.join(self.tmp_dir, 'manifest.json'), 'w') as f:
+            json.dump({
+                'version': manifest_version,
+                'path': os.path.abspath(self.path),
+                'rows': self.num_rows,
+                'columns': manifest_columns,
+            }, f)
+
+        try:
+            os.rename(self.tmp_dir, os.path.join(self.cache_dir, self.key))
+        except OSError as e:
+            # Another session stored the same file first.
+            print(f'Could not store {self.path} in the parsed cache: {e}')
+            self.abort()
+            return False
+
+        evict(keep=self.key)
+        return True
+
+    def abort(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def store(path, columns, rows):
+    """ Writes the columns (name -> numpy array) to the cache for this file and evicts old entries
+        if the cache is over budget. """
+    if not is_enabled() or os.path.isdir(os.path.join(get_cache_dir(), get_key(path))):
+        return
+
+    writer = None
+    try:
+        writer = EntryWriter(path)
+        writer.append(columns)
+        writer.finish()
+    except OSError as e:
+        # Out of space, most likely.
+        print(f'Could not store {path} in the parsed cache: {e}')
+        if writer is not None:
+            writer.abort()
+
+
+def store_in_background(path, df):
+    """ Stores df as it is now.  Columns the session adds later (math variables) aren't stored. """
+    columns = {}
+    for name in df.columns:
+        if isinstance(df[name].dtype, pd.CategoricalDtype):
+            # Kept as a categorical (pickled).
+            columns[name] = df[name].array
+        else:
+            columns[name] = df[name].to_numpy()
+    threading.Thread(target=store, args=(path, columns, len(df)), daemon=True).start()
+
+
+@contextmanager
+def pinned(key):
+    """ Keeps evict(), in any session, from removing the entry while it is being opened. """
+    pin_path = os.path.join(get_cache_dir(), f'{key}.pin-{uuid.uuid4()}')
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    open(pin_path, 'w').close()
+    try:
+        yield
+    finally:
+        try:
+            os.remove(pin_path)
+        except FileNotFoundError:
+            pass
+
+
+def entry_size(entry_dir):
+    """ 0 if the entry is removed meanwhile (by another session's evict()). """
+    size = 0
+    try:
+        for f in os.listdir(entry_dir):
+            try:
+                size += os.path.getsize(os.path.join(entry_dir, f))
+            except FileNotFoundError:
+                pass
+    except FileNotFoundError:
+        pass
+    return size
+
+
+def evict(keep=None):
+    """ Removes the least recently used entries until the cache fits in its budget.  Entries still
+        being written count towards it too, and ones left behind by a session that died are removed. """
+    cache_dir = get_cache_dir()
+    now = time.time()
+    names = os.listdir(cache_dir)
+    pinned_keys = set()
+    for name in names:
+        if '.pin-' in name:
+            try:
+                if now - os.path.getmtime(os.path.join(cache_dir, name)) > stale_seconds:
+                    os.remove(os.path.join(cache_dir, name))
+                    continue
+            except FileNotFoundError:
+                continue
+            pinned_keys.add(name.split('.pin-')[0])
+
+    entries = []
+    total = 0
+    for name in names:
+        entry_dir = os.path.join(cache_dir, name)
+        if '.tmp-' in name:
+            try:
+                stale = now - os.path.getmtime(entry_dir) > stale_seconds
+            except FileNotFoundError:
+                continue
+            if stale:
+                print(f'Removing {name}, left half-written in the parsed cache.')
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            else:
+                total += entry_size(entry_dir)
+            continue
+
+        try:
+            last_used = os.path.getmtime(os.path.join(entry_dir, 'manifest.json'))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        size = entry_size(entry_dir)
+        entries.append((last_used, name, size))
+        total += size
+
+    max_bytes = get_max_bytes()
+    for _, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key == keep or key in pinned_keys:
+            continue
+        print(f'Evicting {key} from the parsed cache.')
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
@@ -30,10 +30,62 @@ URL_PREFIX=/plotplot
 # This is particularly useful when deploying on a server with docker, so you can mount your
 # files at, e.g. "/data" and set this to /data
 #
+# Add &follow=true to keep adding rows as they are appended to a CSV that is still being written
+# (a log, a running experiment):
+#   https://yourserver.com/plot/load_file?filename=dir1/dir2/file.csv&follow=true
+#
 # Comment this line to disable loading files via load_file?filename=
 # EXTERNAL_LOAD_DIR=/tmp
 
 
+################################################
+[performance]
+################################################
+# How many read-only requests (plots, correlations, filter previews) one session can compute at the
+# same time.  Requests that change the data (new subsets, math) always run alone.
+# Defaults to the number of CPUs, up to 4.
+#READER_THREADS=4
+
+# How many CPU-heavy requests (plots, selections, filters, math) can run at once across all sessions.
+# Requests over the limit wait, with users taking turns.  Defaults to a quarter of the CPUs (at least 2).
+#MAX_HEAVY_REQUESTS=8
+
+# Threads each session may use for parallel kernels (numba, OpenMP, BLAS).  Defaults to the number of
+# CPUs divided by MAX_HEAVY_REQUESTS.
+#WORKER_THREADS=4
+
+# How many session workers to keep started and warmed up, ready for the next file that is loaded.
+# Each idle worker uses some memory.  0 turns the pool off.
+#WORKER_POOL_SIZE=1
+
+# Parse CSVs with pyarrow's multi-threaded reader when pyarrow is installed (pip install plotplot[arrow]).
+# Files it can't read the same way pandas would fall back to pandas automatically.
+#ARROW_CSV=true
+
+# Parsed CSVs are cached (in a "parsed_cache" directory in UPLOAD_DIR) so loading the same file again
+# doesn't parse it again.  Least recently used files are removed when the cache is over this size.
+# 0 turns the cache off.
+#PARSED_CACHE_SIZE_GB=10
+
+# CSVs with at least this many columns are written into the parsed cache as they are read and then
+# memory-mapped, so a session only keeps the numeric columns it uses in memory.  Needs the parsed
+# cache.  0 turns this off.
+#WIDE_TABLE_COLUMNS=500
+
+# Store columns in smaller types when loading a CSV: float32 for floats with at most ~7 significant
+# digits, the smallest integer type that fits, and categoricals for string columns with lots of
+# repeated values.  A per-column report is printed.  Not used in wide-table mode.
+#COMPACT_DTYPES=false
+
+# Let users plot a file while it is still loading, over the rows read so far.  Plots made before the
+# file has finished are marked as partial, and changes (new subsets, math) wait until it has finished.
+#PROGRESSIVE_LOADING=true
+
+# Where compiled numba kernels are cached between server restarts.
+# Defaults to a "numba" directory in the "user_cache_dir" for your OS.
+#KERNEL_CACHE_DIR=/tmp/plotplot-kernels
+
+
 ################################################
 [jupyter notebook export]
 ################################################
@@ -113,6 +165,18 @@ def get_upload_dir():
         os.makedirs(upload_dir, exist_ok=True)
     return upload_dir
 
+def get_kernel_cache_dir():
+    config = get_plotplot_config()
+    try:
+        kernel_cache_dir = config['performance']['kernel_cache_dir']
+    except KeyError:
+        # Use the default value
+        kernel_cache_dir = os.path.join(platformdirs.user_cache_dir('plotplot', 'plotplot'), 'numba')
+
+    # Create the directory if needed
+    os.makedirs(kernel_cache_dir, exist_ok=True)
+    return kernel_cache_dir
+
 def validate_config(config):
     required_sections = [
         'plotplot general',
@@ -208,7 +272,14 @@ def get_boolean_with_default(section, key, default):
 def get_boolean_with_default_helper(config, section, key, default):
     try:
         return config.getboolean(section, key)
-    except configparser.NoOptionError:
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        return default
+
+def get_int_with_default(section, key, default):
+    config = get_plotplot_config()
+    try:
+        return config.getint(section, key)
+    except (configparser.NoSectionError, configparser.NoOptionError):
         return default
 
 def allow_recent_files():
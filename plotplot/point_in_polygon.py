@@ -1,6 +1,6 @@
-from numba import jit, njit
 import numba
 import numpy as np
+from .kernel_cache import kernel, parallel_kernel_lock
 
 # From: https://github.com/sasamil/PointInPolygon_Py/blob/master/pointInside.py
 #
@@ -8,7 +8,7 @@ import numpy as np
 # https://stackoverflow.com/a/66189882/730138
 
 
-@jit(nopython=True)
+@kernel([(numba.float64[:, ::1], numba.float64[::1]), (numba.float64[:, ::1], numba.float32[::1])])
 def is_inside_sm(polygon, point):
     length = len(polygon) - 1
     dy2 = point[1] - polygon[0][1]
@@ -47,7 +47,7 @@ def is_inside_sm(polygon, point):
     return intersections & 1
 
 
-@njit(parallel=True)
+@kernel([(numba.float64[:, ::1], numba.float64[:, ::1]), (numba.float32[:, ::1], numba.float64[:, ::1])], parallel=True)
 def is_inside_sm_parallel(points, polygon):
     ln = len(points)
     D = np.empty(ln, dtype=numba.boolean)
@@ -57,6 +57,11 @@ def is_inside_sm_parallel(points, polygon):
 
 
 def pd_inside_polygon(df, colx, coly, polygon):
-    datap = np.dstack((df[colx], df[coly]))
+    # float32 or float64 arrays so the precompiled kernels are used (see kernel_cache.py).  Compacted
+    # float32 columns stay float32.
+    dtype = np.float32 if df[colx].dtype == np.float32 and df[coly].dtype == np.float32 else np.float64
+    datap = np.ascontiguousarray(np.column_stack((df[colx], df[coly])), dtype=dtype)
+    polygon = np.ascontiguousarray(polygon, dtype=np.float64)
 
-    return is_inside_sm_parallel(datap[0], polygon)
\ No newline at end of file
+    with parallel_kernel_lock:
+        return is_inside_sm_parallel(datap, polygon)
\ No newline at end of file
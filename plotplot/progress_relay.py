@@ -0,0 +1,107 @@
+import json
+import threading
+import copy
+from queue import Empty
+
+
+class ProgressPublisher():
+    """ Handed to the loader threads in the worker.  Tags each progress update with its kind
+        ('loading', 'cloud' or 'follow') and sends it to the session's ProgressRelay. """
+
+    def __init__(self, progress_queue, kind):
+        self.progress_queue = progress_queue
+        self.kind = kind
+
+    def put(self, progress):
+        self.progress_queue.put((self.kind, progress))
+
+
+class ProgressRelay(threading.Thread):
+    """ Lives in the Flask process, one per session.  Keeps the latest loading and Google Drive
+        download progress sent by the worker's loader threads, so progress requests are answered here
+        without a round trip to the worker. """
+
+    def __init__(self, data_id, progress_queue, worker):
+        threading.Thread.__init__(self)
+        self.data_id = data_id
+        self.progress_queue = progress_queue
+        self.worker = worker
+        self.lock = threading.Lock()
+        self.latest = {
+            'loading': {
+                'progress': 0,
+                'rows_loaded': 0,
+                'total_rows': 0,
+                'math_vars_loaded': None,
+                'math_vars_total': None,
+                'text': 'Opening file...',
+                'done': False,
+            },
+            'cloud': {
+                'progress': 0.0,
+                'downloaded_bytes': 0.0,
+                'total_bytes': 0.0,
+                'in_cache': False
+            },
+            # Rows in a followed file, updated when rows are appended.
+            'follow': {
+                'rows': None,
+                'stopped': False,
+            },
+        }
+        self.versions = {'loading': 0, 'cloud': 0, 'follow': 0}
+        self.daemon = True
+
+    def run(self):
+        while True:
+            try:
+                kind, progress = self.progress_queue.get(timeout=5)
+            except Empty:
+                if self.worker.is_alive():
+                    continue
+                break
+
+            with self.lock:
+                if kind == 'loading':
+                    progress.setdefault('done', False)
+                self.latest[kind] = progress
+                self.versions[kind] += 1
+
+    def get(self, kind):
+        """ JSON of the latest progress of this kind. """
+        with self.lock:
+            progress = copy.copy(self.latest[kind])
+        if kind == 'loading':
+            progress['data_id'] = self.data_id
+        return json.dumps(progress)
+
+    def changed_since(self, version_id):
+        """ The kinds of progress that changed since version_id (from an earlier call, or None for
+            all of them), and the version_id for now.  Doesn't wait. """
+        seen = {}
+        if version_id:
+            try:
+                seen = dict(zip(self.versions, (int(v) for v in version_id.split('.'))))
+            except ValueError:
+                pass
+        with self.lock:
+            changed = [kind for kind in self.versions if self.versions[kind] != seen.get(kind)]
+            version_id = '.'.join(str(v) for v in self.versions.values())
+        return changed, version_id
+
+    def is_following(self):
+        """ True while a followed file is loaded and waiting for rows to be appended. """
+        with self.lock:
+            loading = self.latest['loading']
+            return loading.get('done', False) and loading.get('following', False) and not self.latest['follow']['stopped']
+
+    def is_finished(self):
+        """ True once loading is done or failed, after which no more progress is coming.  A followed
+            file isn't finished until following stops. """
+        with self.lock:
+            loading = self.latest['loading']
+            if 'error' in loading:
+                return True
+            if loading.get('following', False):
+                return self.latest['follow']['stopped']
+            return loading.get('done', False)
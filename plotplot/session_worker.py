@@ -23,9 +23,17 @@ from . import api_utils
 from plotplot.load_csv_thread import LoadCsvThread
 from plotplot.gdrive_download_thread import GdriveDownloadThread
 from . import point_in_polygon
+from . import shared_payload
+from .progress_relay import ProgressPublisher
+from . import admission
 from plotplot.gdrive_cloud import PlotplotGdrive
 import pathlib
+import threading
+import itertools
+import queue
+import types
 from queue import Empty
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from line_profiler import LineProfiler
 from io import StringIO
@@ -33,24 +41,36 @@ from io import StringIO
 ENABLE_LINE_PROFILER = False
 
 
-def call_worker(id, function_name, args):
-    """ Finds the multiprocessing process and gets the result.
-    """
+def get_process_data(id):
+    """ Returns (process data, None) for a live session or (None, error JSON). """
     with g_process_lock:
         if id not in g_processes:
-            return json.dumps({'error': api_utils.invalid_session_id_err_str})
+            return None, json.dumps({'error': api_utils.invalid_session_id_err_str})
         pdata = g_processes[id]
 
         # Check to see this processes has shutdown
         if not pdata['shutdown'].empty():
             # This process has shutdown, tell the requester that it needs to restart it.
             del g_processes[id]
-            result = json.dumps({'error': 'Session has timed out, you need to reload the page.', 'session_timeout': True})
-            return result
+            return None, json.dumps({'error': api_utils.session_timeout_err_str, 'session_timeout': True})
+
+    return pdata, None
+
+
+def call_worker(id, function_name, args):
+    """ Finds the multiprocessing process and gets the result.
+    """
+    pdata, error = get_process_data(id)
+    if pdata is None:
+        return error
 
-    pdata['input'].put(SessionRequest(function_name, args))
+    # Each request gets its own future, so several Flask threads can have requests in flight for the
+    # same session at once.  The dispatcher matches replies to requests by ID.
+    future = pdata['dispatcher'].submit(pdata['input'], function_name, args, user=admission.current_user_key())
+    raw_result = future.result()
 
-    result = pdata['output'].get()
+    # Large results arrive as a handle to shared memory rather than the data itself.
+    result = shared_payload.unpack(raw_result)
 
     if isinstance(result, dict):
         # Unpack and process DB transactions.
@@ -69,25 +89,373 @@ def call_worker(id, function_name, args):
         return result
 
 
+# CPU-heavy functions, counted against the server-wide limit on concurrent heavy requests.  The worker
+# asks for a slot just before one runs (SessionWorker.admit), after newer requests have had the chance
+# to replace it, and gives it back when it's done.
+heavy_funcs = {
+    'plot_json',
+    'select_data',
+    'do_math',
+    'filter',
+    'levenshtein_filter',
+    'get_unique_strings',
+    'calc_correlation',
+    'bulk_import',
+    'download_subset',
+    'plot_batch',
+}
+
+
+def call_worker_stream(id, function_name, args):
+    """ Like call_worker, for worker functions that return a generator.  Yields each piece of the
+        reply as soon as the worker sends it.  Run it inside the Flask request (stream_with_context).
+    """
+    pdata, error = get_process_data(id)
+    if pdata is None:
+        yield error + '\n'
+        return
+
+    replies = pdata['dispatcher'].submit(pdata['input'], function_name, args, stream=True, user=admission.current_user_key())
+    try:
+        for result in replies.results():
+            if isinstance(result, str) and len(result) > 0 and result[-1] != '\n':
+                # A final error or preempt from the worker, end it like the other lines.
+                result += '\n'
+            yield from shared_payload.iterate(result)
+    finally:
+        # Does nothing if the whole reply was read.  If the client went away part way through, the
+        # rest of the reply is thrown away and the worker stops working on it.
+        pdata['dispatcher'].abandon(pdata['input'], replies)
+
+
+def plot_json_key(args):
+    return args['data']['key']
+
+
+def filter_preview_key(args):
+    data = args['data']
+    if data.get('add_subset') or data.get('add_multiple_subsets'):
+        # Creates subsets, must always run.
+        return None
+    return (data.get('subset_id'), data.get('filter_var'))
+
+
+def unique_strings_key(args):
+    data = args['data']
+    return (data.get('subset_id'), data.get('filter_var'))
+
+
+def calc_correlation_key(args):
+    data = args['data']
+    return (data.get('x'), data.get('y'), str(data.get('subset_ids')))
+
+
+def bulk_import_key(args):
+    # Only the same import sent again, e.g. a double click.  Subsets are only added once every row has
+    # matched, so cancelling the first part way through leaves nothing behind.
+    data = args['data']
+    return (data.get('subset_id'), data.get('filterColumn'), data.get('use_contains'), data.get('bulkImport'))
+
+
+# Requests where only the newest one for a logical key matters.  Maps function name to a function that
+# returns the request's key, or None when that particular request must not be dropped.
+coalesce_key_funcs = {
+    'plot_json': plot_json_key,
+    'filter': filter_preview_key,
+    'levenshtein_filter': filter_preview_key,
+    'get_unique_strings': unique_strings_key,
+    'calc_correlation': calc_correlation_key,
+    'bulk_import': bulk_import_key,
+}
+
+
+def coalesce_key(request):
+    if request.function_name not in coalesce_key_funcs:
+        return None
+    return coalesce_key_funcs[request.function_name](request.args)
+
+
+def is_read_only(request):
+    """ Read-only requests can run at the same time as each other on the reader pool.  Everything
+        else (new subsets, math, deletes) runs alone. """
+    if request.function_name in ('plot_json', 'plot_batch', 'calc_correlation', 'get_unique_strings', 'column_stats'):
+        return True
+    if request.function_name in ('filter', 'levenshtein_filter'):
+        # Previews only, filters that add subsets are writers.
+        return filter_preview_key(request.args) is not None
+    return False
+
+
+class ReadWriteLock():
+    """ Lets any number of readers or a single writer hold the lock.  A waiting writer blocks new
+        readers so it can't be starved by a stream of plots. """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+
+    def acquire_read(self):
+        with self.cond:
+            while self.writer or self.writers_waiting > 0:
+                self.cond.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.cond:
+            self.readers -= 1
+            if self.readers == 0:
+                self.cond.notify_all()
+
+    def acquire_write(self):
+        with self.cond:
+            self.writers_waiting += 1
+            while self.writer or self.readers > 0:
+                self.cond.wait()
+            self.writers_waiting -= 1
+            self.writer = True
+
+    def try_acquire_write(self):
+        """ Takes the write lock only if it is free right now.  Returns whether it was taken. """
+        with self.cond:
+            if self.writer or self.readers > 0 or self.writers_waiting > 0:
+                return False
+            self.writer = True
+            return True
+
+    def release_write(self):
+        with self.cond:
+            self.writer = False
+            self.cond.notify_all()
+
+
 class SessionRequest():
     """ Inputs come in this form. """
 
-    def __init__(self, function_name, args):
+    def __init__(self, function_name, args, request_id=None):
         self.function_name = function_name
         self.args = args
+        self.request_id = request_id
+        # Set in the worker once a heavy request holds an admission slot.
+        self.admitted = False
+        # Set in the worker once the request is ready to run (see SessionWorker.prepare).
+        self.prepared = False
+        self.preempted = False
+
+
+class SessionCancel():
+    """ Sent when nobody is waiting for a request's reply any more. """
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+
+
+class AdmissionMessage():
+    """ Server-wide admission for heavy requests (see admission.py), which lives in the Flask process.
+        The worker sends 'acquire' before a heavy request runs and 'release' after; the dispatcher
+        answers 'grant' on the input queue when the request may run. """
+
+    def __init__(self, action, request_id):
+        self.action = action
+        self.request_id = request_id
+
+
+class SessionAdoption():
+    """ Sent to an idle, pre-started worker to hand it a session (see worker_pool.py). """
+
+    def __init__(self, id, datapath, gdrive_file_info, subsets_from_db, math_vars, follow=False):
+        self.id = id
+        self.datapath = datapath
+        self.gdrive_file_info = gdrive_file_info
+        self.subsets_from_db = subsets_from_db
+        self.math_vars = math_vars
+        self.follow = follow
+
+
+class SessionResponse():
+    """ Outputs go back in this form, tagged with the ID of the request they answer.  Functions that
+        return a generator send one response per piece with more=True, then a last one. """
+
+    def __init__(self, request_id, result, more=False):
+        self.request_id = request_id
+        self.result = result
+        self.more = more
+
+
+class ReplyStream():
+    """ Stands in for the Future of a request that is answered with several responses. """
+
+    def __init__(self):
+        self.replies = queue.Queue()
+        self.request_id = None
+        self.done = False
+        # Set when the reader went away.  Replies for it are thrown away (see ResponseDispatcher).
+        self.abandoned = False
+
+    def add_partial_result(self, result):
+        self.replies.put((result, False))
+
+    def set_result(self, result):
+        self.replies.put((result, True))
+
+    def results(self):
+        while True:
+            result, done = self.replies.get()
+            self.done = done
+            yield result
+            if done:
+                return
+
+    def drain(self):
+        """ Takes the replies that haven't been read. """
+        drained = []
+        while True:
+            try:
+                drained.append(self.replies.get_nowait()[0])
+            except Empty:
+                return drained
+
+
+class ResponseDispatcher(threading.Thread):
+    """ Lives in the Flask process, one per session.  Reads replies from the session's output queue
+        and hands each one to the future of the request it answers.
+
+        Replies can come back in any order, so the worker is free to pipeline requests instead of
+        the Flask side serializing them by hand."""
+
+    def __init__(self, data_id, input_queue, output_queue, worker):
+        threading.Thread.__init__(self)
+        self.data_id = data_id
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.worker = worker
+        self.pending = {}
+        # Request ID -> user, for admission, and the requests holding an admission slot.
+        self.users = {}
+        self.admitted = set()
+        self.pending_lock = threading.Lock()
+        self.next_request_id = itertools.count()
+        self.closed = False
+        self.daemon = True
+
+    def submit(self, input_queue, function_name, args, stream=False, user=None):
+        future = ReplyStream() if stream else Future()
+        with self.pending_lock:
+            if self.closed:
+                future.set_result(json.dumps({'error': api_utils.session_timeout_err_str, 'session_timeout': True}))
+                return future
+            request_id = next(self.next_request_id)
+            self.pending[request_id] = future
+            self.users[request_id] = user
+            if stream:
+                future.request_id = request_id
+
+        input_queue.put(SessionRequest(function_name, args, request_id))
+        return future
+
+    def abandon(self, input_queue, stream):
+        """ The reader of a streamed reply went away.  Its unread replies, and any that come later, are
+            thrown away, and the worker is asked to cancel the request if it hasn't finished. """
+        with self.pending_lock:
+            if stream.done:
+                return
+            stream.abandoned = True
+            unread = stream.drain()
+            still_running = self.pending.get(stream.request_id) is stream
+        for result in unread:
+            shared_payload.discard(result)
+        if still_running:
+            input_queue.put(SessionCancel(stream.request_id))
+
+    def handle_admission(self, message):
+        if message.action == 'acquire':
+            with self.pending_lock:
+                user = self.users.get(message.request_id)
+            # Waiting for a slot can take a while, so not on this thread.
+            threading.Thread(target=self.grant, args=(message.request_id, user), daemon=True).start()
+        elif message.action == 'release':
+            with self.pending_lock:
+                if message.request_id not in self.admitted:
+                    return
+                self.admitted.remove(message.request_id)
+            admission.get_admission_controller().release()
+
+    def grant(self, request_id, user):
+        admission.get_admission_controller().acquire(user)
+        with self.pending_lock:
+            if not self.closed:
+                self.admitted.add(request_id)
+                self.input_queue.put(AdmissionMessage('grant', request_id))
+                return
+        # The worker has exited.
+        admission.get_admission_controller().release()
+
+    def run(self):
+        while True:
+            try:
+                response = self.output_queue.get(timeout=5)
+            except Empty:
+                if self.worker.is_alive():
+                    continue
+                break
+
+            if isinstance(response, AdmissionMessage):
+                self.handle_admission(response)
+                continue
+
+            with self.pending_lock:
+                if response.more:
+                    future = self.pending.get(response.request_id)
+                else:
+                    future = self.pending.pop(response.request_id, None)
+                    self.users.pop(response.request_id, None)
+
+                abandoned = future is None or getattr(future, 'abandoned', False)
+                if not abandoned:
+                    # Under the lock so abandon() can't miss it.
+                    if response.more:
+                        future.add_partial_result(response.result)
+                    else:
+                        future.set_result(response.result)
+
+            if abandoned:
+                if future is None:
+                    print(f'Session {self.data_id}: dropping reply for unknown request {response.request_id}.')
+                # Nobody will read it, so its shared memory would never be freed.
+                shared_payload.discard(response.result)
+
+        # The worker has exited, nothing else is coming back.  Release anyone still waiting, and the
+        # admission slots its requests held.
+        with self.pending_lock:
+            self.closed = True
+            pending = self.pending
+            self.pending = {}
+            admitted = self.admitted
+            self.admitted = set()
+
+        for request_id in admitted:
+            admission.get_admission_controller().release()
+
+        for future in pending.values():
+            future.set_result(json.dumps({'error': api_utils.session_timeout_err_str, 'session_timeout': True}))
+        print(f'Session {self.data_id} response dispatcher stopped.')
 
 
 class SessionWorker(mp.Process):
     """ Each UUID session has a worker process which holds the DataFrame for that process in its memeory.
         Actions that need access to the DataFrame talk to the process.
 
-        This allows us to handle multiple clients and multiple CPU-bound tasks at once.  The limitations
-        are that you can't do multiple CPU-bound tasks on the same DataFrame at the same time (like making
-        multiple plots at once."""
+        This allows us to handle multiple clients and multiple CPU-bound tasks at once.  Read-only tasks
+        (like making multiple plots at once) run in parallel on a small thread pool, while tasks that
+        change the data run alone.  Cheap read-only calls (see fast_funcs) are answered by a second
+        thread so they don't wait behind any of those tasks."""
 
     def __init__(self, id, datapath, gdrive_file_info, input_queue,
-                 output_queue, shutdown_queue, subsets_from_db, math_vars):
+                 output_queue, shutdown_queue, subsets_from_db, math_vars, adopt_queue=None, follow=False):
         super(mp.Process, self).__init__()
+        # Pooled workers start without a session and wait for a SessionAdoption on this queue.
+        self.adopt_queue = adopt_queue
         self.id = id
         self.path = datapath
         self.gdrive_file_info = gdrive_file_info
@@ -95,35 +463,27 @@ class SessionWorker(mp.Process):
         self.output_queue = output_queue
         self.shutdown_queue = shutdown_queue
         self.subsets_from_db = subsets_from_db
-        self.loading_progress_queue = mp.Queue()
-        self.gdrive_progress_queue = mp.Queue()
-        self.data_lock = mp.Lock()
+        # Loading and download progress, read by the ProgressRelay in the Flask process.
+        self.progress_queue = mp.Queue()
+        # Reentrant so fast-lane functions can call get_data() while the lane holds the lock.
+        self.data_lock = mp.RLock()
         self.data = dict()
-        self.last_progress = {
-            'progress': 0,
-            'rows_loaded': 0,
-            'total_rows': 0,
-            'math_vars_loaded': None,
-            'math_vars_total': None,
-            'text': 'Opening file...',
-        }
-        self.last_gdrive_progress = {
-            'progress': 0.0,
-            'downloaded_bytes': 0.0,
-            'total_bytes': 0.0,
-            'in_cache': False
-        }
         self.pending_requests = []
+        self.running_requests = []
         self.pending_download_files = {}
         self.gdrive = None
         self.math_vars = math_vars
+        # Keep reading rows appended to the file after it has loaded (see LoadCsvThread.follow_file).
+        self.follow = follow
+        # Read here, in the server process, so every worker gets the same budget.
+        self.worker_threads = admission.get_worker_threads()
 
         self.funcs = {
-            'processing_progress': self.processing_progress,
             'get_subsets': self.get_subsets,
             'get_columns': self.get_columns,
             'get_non_numeric_columns': self.get_non_numeric_columns,
             'plot_json': self.plot_json,
+            'plot_batch': self.plot_batch,
             'select_data': self.select_data,
             'delete_subset': self.delete_subset,
             'do_math': self.do_math,
@@ -131,13 +491,38 @@ class SessionWorker(mp.Process):
             'download_file': self.download_file,
             'filter': self.filter,
             'get_unique_strings': self.get_unique_strings,
-            'cloud_progress': self.gdrive_progress,
             'calc_correlation': self.calc_correlation,
             'bulk_import': self.bulk_import,
             'levenshtein_filter': self.levenshtein_filter,
+            'column_stats': self.column_stats,
+        }
+
+        # Cheap, read-only functions that skip the queue of heavy requests.
+        self.fast_funcs = {
+            'get_columns',
+            'get_subsets',
+            'get_non_numeric_columns',
         }
 
     def run(self):
+        admission.apply_thread_budget(self.worker_threads)
+
+        # Readers of self.data (plots, correlations, filter previews) share data_rw_lock and run on the
+        # reader pool.  Writers take it exclusively and run on this thread.  The loader also takes it
+        # to swap in each partial snapshot of a file that is still loading.
+        self.data_rw_lock = ReadWriteLock()
+
+        if self.adopt_queue is not None:
+            self.warm_up()
+            session = self.adopt_queue.get()
+            self.id = session.id
+            self.path = session.datapath
+            self.gdrive_file_info = session.gdrive_file_info
+            self.subsets_from_db = session.subsets_from_db
+            self.math_vars = session.math_vars
+            self.follow = session.follow
+            print(f'Pooled worker adopted session {self.id}.')
+
         if self.gdrive_file_info is not None and plotplot_config.get_boolean_with_default('google drive', 'google_drive_connection_enabled', False):
             self.gdrive = PlotplotGdrive()
             self.start_gdrive_download()
@@ -145,88 +530,298 @@ class SessionWorker(mp.Process):
             # Start the data loading thread.
             self.start_loading_data()
 
+        # Requests are read off the input queue by a separate thread so cheap, read-only calls can be
+        # answered right away instead of waiting behind a plot or filter.
+        self.pending_lock = threading.Condition()
+        self.intake_done = False
+        # Request ID -> Event set when a heavy request is granted its admission slot.
+        self.admission_waits = {}
+        # Requests taken off pending_requests that are waiting on SessionWorker.prepare.
+        self.preparing = []
+        intake_thread = threading.Thread(target=self.intake_requests, daemon=True)
+        intake_thread.start()
+
+        reader_threads = plotplot_config.get_int_with_default('performance', 'reader_threads', min(4, os.cpu_count()))
+        reader_threads = max(1, reader_threads)
+        self.reader_slots = threading.Semaphore(reader_threads)
+        self.reader_pool = ThreadPoolExecutor(max_workers=reader_threads)
+
         while True:
-            if len(self.pending_requests) < 1:
-                # Blocking call, waiting for inputs.
-                try:
-                    req = self.input_queue.get(timeout=26 * 3600)
-                except Empty:
-                    print(f'Session {self.id} queue timeout, shutting down.')
-                    break
+            request = self.next_request()
+            if request is None:
+                break
+
+            if not request.prepared and self.needs_preparing(request):
+                # Waiting for an admission slot or a math restore happens on its own thread, so it
+                # doesn't hold up the requests behind it.
+                with self.pending_lock:
+                    self.preparing.append(request)
+                threading.Thread(target=self.prepare, args=(request,), daemon=True).start()
+                continue
 
-                self.pending_requests.append(req)
+            if request.preempted:
+                self.output_queue.put(SessionResponse(request.request_id,
+                    json.dumps({'preempt': 'Request cancelled by a newer request.'})))
+                self.request_finished(request)
+                continue
 
+            if is_read_only(request):
+                # Taking the read lock here, in request order, means a reader never jumps ahead of a
+                # writer that was queued before it.
+                self.reader_slots.acquire()
+                self.data_rw_lock.acquire_read()
+                self.reader_pool.submit(self.run_reader, request)
+                continue
 
+            self.data_rw_lock.acquire_write()
+            try:
+                if self.is_partial():
+                    # Changes made now would be lost when the next snapshot replaces the data.
+                    self.output_queue.put(SessionResponse(request.request_id, json.dumps({'error': api_utils.data_partial_str})))
+                else:
+                    self.run_request(request)
+            finally:
+                self.data_rw_lock.release_write()
+                self.request_finished(request)
 
-            # Get any additional requests.
-            while not self.input_queue.empty():
-                self.pending_requests.append(self.input_queue.get())
+        self.shutdown_queue.put(True)
+        print(f'Session {self.id} end of thread.')
 
-            request = self.pending_requests.pop(0)
+    def warm_up(self):
+        """ Runs a tiny plot and polygon selection so the JIT compiles and library start-up costs are
+            paid before a session is attached, not on the user's first plot. """
+        start_time = time.time()
+        # Over max_rows_for_heatmap, so the datashader path is taken too.
+        n = api_utils.max_rows_for_heatmap + 1000
+        df = pd.DataFrame({'x': np.linspace(1e-3, 1, n), 'y': np.linspace(1, 1e-3, n), 'z': np.linspace(0, 1, n)})
+        idx = pd.Series(np.ones(n, dtype=bool))
 
-            if request.function_name not in self.funcs:
-                self.output_queue.put(
-                    json.dumps({
-                        'error':
-                        'Requested function: ' + request.function_name +
-                        ' not in list of functions.'
-                    }))
+        fig = go.Figure()
+        api_utils.generate_scatter(df, 'x', 'y', None, [idx], fig, False, 0, 1, 0, 1, False, False)
+        # Log axes (extrema_while_nb), a color variable and the bounding-box kernel.
+        api_utils.generate_scatter(df, 'x', 'y', 'z', [idx], go.Figure(), True, 0, 1, 0, 1, True, True)
+        api_utils.generate_histogram(df, [idx], go.Figure(), 'x', 50, 'count')
+        json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
+        polygon = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 0.0)]
+        point_in_polygon.pd_inside_polygon(df, 'x', 'y', polygon)
+
+        print(f'Worker warm-up took {time.time() - start_time:.2f} seconds.')
+
+    def next_request(self):
+        """ The next request to run, in order except that a reader may run while an earlier reader is
+            being prepared.  Nothing runs ahead of a writer, or a writer ahead of anything.  None once
+            intake has ended and everything has run. """
+        with self.pending_lock:
+            while True:
+                for i, request in enumerate(self.preparing):
+                    if request.prepared and (i == 0 or is_read_only(request)):
+                        return self.preparing.pop(i)
+                    if not is_read_only(request):
+                        break
+
+                preparing_writer = any(not is_read_only(request) for request in self.preparing)
+                if len(self.pending_requests) > 0 and not preparing_writer and \
+                        (len(self.preparing) < 1 or is_read_only(self.pending_requests[0])):
+                    request = self.pending_requests.pop(0)
+                    self.running_requests.append(request)
+                    return request
+
+                if len(self.pending_requests) < 1 and len(self.preparing) < 1 and self.intake_done:
+                    return None
+                self.pending_lock.wait()
+
+    def needs_preparing(self, request):
+        return request.function_name in heavy_funcs or len(self.pending_math_columns(request)) > 0
+
+    def prepare(self, request):
+        """ Waits for a heavy request's admission slot and restores the math variables it uses. """
+        try:
+            if self.admit(request):
+                self.restore_math_columns(request)
             else:
-                if ENABLE_LINE_PROFILER:
-                    lp = LineProfiler()
-                    lp_wrapper = lp(self.funcs[request.function_name])
-                try:
-                    if ENABLE_LINE_PROFILER:
-                        result = lp_wrapper(request.args)
-                    else:
-                        result = self.funcs[request.function_name](request.args)
-                except BaseException as e:
-                    tb = traceback.format_exc()
-                    print(e)
-                    print(str(tb))
-                    result = json.dumps(dict(error=str(e) + '\n\n' + str(tb)))
-                
-                if ENABLE_LINE_PROFILER:
-                    lp.print_stats(output_unit=0.001)
+                request.preempted = True
+        finally:
+            with self.pending_lock:
+                request.prepared = True
+                self.pending_lock.notify_all()
+
+    def pending_math_columns(self, request):
+        """ The stored math variables a request uses that the loader hasn't restored yet. """
+        with self.data_lock:
+            math_restore = self.data.get('math_restore')
+        if math_restore is None:
+            return set()
+        return math_restore.pending_in(request.args)
 
-                self.output_queue.put(result)
+    def restore_math_columns(self, request):
+        """ Restores the stored math variables a request uses, if the loader hasn't got to them yet. """
+        with self.data_lock:
+            math_restore = self.data.get('math_restore')
+        if math_restore is None:
+            return
+        names = math_restore.pending_in(request.args)
+        if len(names) > 0:
+            math_restore.restore(names)
+
+    def run_reader(self, request):
+        try:
+            self.run_request(request)
+        finally:
+            self.data_rw_lock.release_read()
+            self.reader_slots.release()
+            self.request_finished(request)
+
+    def admit(self, request):
+        """ Waits for a server-wide slot for a heavy request (see AdmissionMessage).  Returns False,
+            without a slot, if the request is cancelled while it waits. """
+        if request.function_name not in heavy_funcs:
+            return True
+        granted = threading.Event()
+        with self.pending_lock:
+            self.admission_waits[request.request_id] = granted
+        self.output_queue.put(AdmissionMessage('acquire', request.request_id))
+        while not granted.wait(0.1):
+            if request.cancel_token.is_cancelled():
+                with self.pending_lock:
+                    del self.admission_waits[request.request_id]
+                    if not granted.is_set():
+                        # intake_requests gives the slot back when it is granted.
+                        return False
+                self.output_queue.put(AdmissionMessage('release', request.request_id))
+                return False
+        with self.pending_lock:
+            self.admission_waits.pop(request.request_id, None)
+        request.admitted = True
+        return True
+
+    def request_finished(self, request):
+        if request.admitted:
+            self.output_queue.put(AdmissionMessage('release', request.request_id))
+        with self.pending_lock:
+            self.running_requests.remove(request)
+
+    def intake_requests(self):
+        """ Second dispatch lane.  Functions in self.fast_funcs are run here, under data_lock, as soon as
+            they arrive.  Everything else goes to pending_requests for the main loop. """
+        while True:
+            # Blocking call, waiting for inputs.
+            try:
+                request = self.input_queue.get(timeout=26 * 3600)
+            except Empty:
+                print(f'Session {self.id} queue timeout, shutting down.')
+                break
+
+            if isinstance(request, SessionCancel):
+                with self.pending_lock:
+                    self.cancel_request(request.request_id)
+                continue
 
-        self.shutdown_queue.put(True)
-        print(f'Session {self.id} end of thread.')
+            if isinstance(request, AdmissionMessage):
+                with self.pending_lock:
+                    granted = self.admission_waits.get(request.request_id)
+                    if granted is not None:
+                        granted.set()
+                if granted is None:
+                    # Cancelled while it waited.
+                    self.output_queue.put(AdmissionMessage('release', request.request_id))
+                continue
 
-    def processing_progress(self, args):
-        with self.data_lock:
-            if 'df' in self.data:
-                return json.dumps({
-                    'progress': 1,
-                    'rows_loaded': None,
-                    'total_rows': None,
-                    'data_id': self.id,
-                    'done': True,
-                })
+            if request.function_name in self.fast_funcs:
+                with self.data_lock:
+                    self.run_request(request)
+                continue
 
-        # The processing isn't done yet, get the progress.
-        if self.loading_progress_queue.empty():
-            progress_data = self.last_progress
-        else:
-            while not self.loading_progress_queue.empty():
-                progress_data = self.loading_progress_queue.get()
-        self.last_progress = progress_data
+            request.cancel_token = api_utils.CancelToken()
 
-        progress_data['data_id'] = self.id
-        progress_data['done'] = False
-        
-        return json.dumps(progress_data)
+            with self.pending_lock:
+                self.supersede_older_requests(request)
+                self.pending_requests.append(request)
+                self.pending_lock.notify()
 
-    def gdrive_progress(self, args):
-        if self.gdrive_progress_queue.empty():
-            gdrive_progress = self.last_gdrive_progress
-        else:
-            while not self.gdrive_progress_queue.empty():
-                gdrive_progress = self.gdrive_progress_queue.get()
-        self.last_gdrive_progress = gdrive_progress
+        with self.pending_lock:
+            self.intake_done = True
+            self.pending_lock.notify()
+
+    def supersede_older_requests(self, request):
+        """ A new request replaces older ones with the same function and logical key (see
+            coalesce_key_funcs).  Queued ones get a cheap "preempt" reply right away and in-flight
+            ones are cancelled, so the worker only spends time on the newest.  Call with pending_lock
+            held. """
+        key = coalesce_key(request)
+        if key is None:
+            return
 
-        return json.dumps(gdrive_progress)
+        still_pending = []
+        for r in self.pending_requests:
+            if r.function_name == request.function_name and coalesce_key(r) == key:
+                print(r.function_name + ' superseded for key ' + str(key))
+                self.output_queue.put(SessionResponse(r.request_id,
+                    json.dumps({'preempt': 'Request superseded by a newer request.'})))
+            else:
+                still_pending.append(r)
+        self.pending_requests[:] = still_pending
+
+        for r in self.running_requests:
+            if r.function_name == request.function_name and coalesce_key(r) == key:
+                print('Cancelling in-flight ' + r.function_name + ' for key ' + str(key))
+                r.cancel_token.cancel()
+
+    def cancel_request(self, request_id):
+        """ Nobody is waiting for the request's reply any more.  Call with pending_lock held. """
+        for r in self.pending_requests:
+            if r.request_id == request_id:
+                print(f'{r.function_name} abandoned before it started.')
+                self.pending_requests.remove(r)
+                self.output_queue.put(SessionResponse(r.request_id,
+                    json.dumps({'preempt': 'Request abandoned by the client.'})))
+                return
+        for r in self.running_requests:
+            if r.request_id == request_id:
+                print(f'Cancelling abandoned {r.function_name}.')
+                r.cancel_token.cancel()
+                return
+
+    def run_request(self, request):
+        if request.function_name not in self.funcs:
+            self.output_queue.put(SessionResponse(request.request_id,
+                json.dumps({
+                    'error':
+                    'Requested function: ' + request.function_name +
+                    ' not in list of functions.'
+                })))
+            return
+
+        if hasattr(request, 'cancel_token'):
+            request.args['cancel_token'] = request.cancel_token
+
+        if ENABLE_LINE_PROFILER:
+            lp = LineProfiler()
+            lp_wrapper = lp(self.funcs[request.function_name])
+        try:
+            if ENABLE_LINE_PROFILER:
+                result = lp_wrapper(request.args)
+            else:
+                result = self.funcs[request.function_name](request.args)
+
+            if isinstance(result, types.GeneratorType):
+                # Send each piece as it is ready, the empty result below ends the stream.
+                for piece in result:
+                    self.output_queue.put(SessionResponse(request.request_id, shared_payload.pack(piece), more=True))
+                result = ''
+        except api_utils.RequestCancelled:
+            print(request.function_name + ' cancelled.')
+            result = json.dumps({'preempt': 'Request cancelled by a newer request.'})
+        except BaseException as e:
+            tb = traceback.format_exc()
+            print(e)
+            print(str(tb))
+            result = json.dumps(dict(error=str(e) + '\n\n' + str(tb)))
+
+        if ENABLE_LINE_PROFILER:
+            lp.print_stats(output_unit=0.001)
+
+        self.output_queue.put(SessionResponse(request.request_id, shared_payload.pack(result)))
 
     def start_gdrive_download(self):
         # Get the file from google drive.
@@ -237,7 +832,7 @@ class SessionWorker(mp.Process):
                 output_path).is_file() and os.path.getsize(output_path) == int(
                     self.gdrive_file_info['size']):
             # File exists and is the same size.  We'll use it.
-            self.gdrive_progress_queue.put({
+            ProgressPublisher(self.progress_queue, 'cloud').put({
                 'progress':
                 1,
                 'downloaded_bytes':
@@ -252,15 +847,17 @@ class SessionWorker(mp.Process):
         else:
             os.makedirs(api_utils.gdrive_folder, exist_ok=True)
             gdrive_download_thread = GdriveDownloadThread(
-                self.gdrive, self.gdrive_progress_queue, self.gdrive_file_info,
+                self.gdrive, ProgressPublisher(self.progress_queue, 'cloud'), self.gdrive_file_info,
                 api_utils.gdrive_folder, self.start_loading_data)
             self.path = output_path
             gdrive_download_thread.start()
 
     def start_loading_data(self):
-        load_thread = LoadCsvThread(self.loading_progress_queue, self.path,
+        follow_progress = ProgressPublisher(self.progress_queue, 'follow') if self.follow else None
+        load_thread = LoadCsvThread(ProgressPublisher(self.progress_queue, 'loading'), self.path,
                                     self.subsets_from_db, self.data,
-                                    self.data_lock, self.math_vars)
+                                    self.data_lock, self.data_rw_lock, self.math_vars,
+                                    follow_progress=follow_progress)
         load_thread.start()
 
     def get_data(self):
@@ -270,6 +867,24 @@ class SessionWorker(mp.Process):
             return self.data['df'], self.data['subsets'], self.data[
                 'subset_counter'], self.data['math_vars'], self.data['col_labels']
 
+    def get_column_stats(self):
+        """ The ColumnStats for self.data, None while a file is still loading. """
+        with self.data_lock:
+            return self.data.get('column_stats')
+
+    def new_column_cache(self, df, subsets):
+        full_idxs = [subset['idx'] for subset in subsets.values() if subset['count'] == len(df)]
+        return api_utils.ColumnCache(df, self.get_column_stats(), full_idxs)
+
+    def get_partial(self):
+        """ While a file is loading progressively, {'rows_loaded', 'total_rows'} for the snapshot in
+            self.data (total_rows is an estimate).  None once the whole file is loaded. """
+        with self.data_lock:
+            return self.data.get('partial')
+
+    def is_partial(self):
+        return self.get_partial() is not None
+
     def get_subsets(self, args):
         return json.dumps(self.get_subsets_no_json(args))
 
@@ -294,6 +909,11 @@ class SessionWorker(mp.Process):
 
         non_numeric = np.setdiff1d(all_cols, numeric_cols).tolist()
 
+        # Math variables that are still being restored are listed too, they're restored on first use.
+        math_restore = self.data.get('math_restore')
+        if math_restore is not None:
+            numeric_cols = numeric_cols + sorted(math_restore.pending_columns - set(all_cols))
+
         #return json.dumps(api_utils.get_numeric_cols(df))
         return json.dumps({
             'numeric': sorted(numeric_cols, key=str.lower),
@@ -301,6 +921,22 @@ class SessionWorker(mp.Process):
             'col_labels': col_labels
         })
 
+    def column_stats(self, args):
+        """ Finite/NaN/infinite counts, min, max, smallest positive value and approximate quantiles
+            of a numeric column. """
+        df, subsets, subset_counter, math_vars, col_labels = self.get_data()
+        if df is None:
+            return json.dumps({'error': api_utils.data_not_loaded_str})
+        column_stats = self.get_column_stats()
+        if column_stats is None:
+            return json.dumps({'error': api_utils.data_partial_str})
+
+        column = api_utils.get_strp(args['data'], 'column')
+        stats = column_stats.get(df, column)
+        if stats is None:
+            return json.dumps({'error': f'No statistics for column "{column}", it is missing or not numeric.'})
+        return json.dumps(stats)
+
     def get_non_numeric_columns(self, args):
         df, subsets, subset_counter, math_vars, col_labels = self.get_data()
         if df is None:
@@ -314,13 +950,6 @@ class SessionWorker(mp.Process):
 
         return json.dumps(non_numeric)
 
-    def future_plot_in_requests(self, args):
-        key = args['data']['key']
-        for r in self.pending_requests:
-            if r.function_name == 'plot_json' and r.args['data']['key'] == key:
-                return True
-        return False
-
     def calc_correlation(self, args):
         df, subsets, subset_counter, math_vars, col_labels = self.get_data()
         correlations = {}
@@ -347,7 +976,8 @@ class SessionWorker(mp.Process):
         for sub_id in subset_ids:
             all_subsets |= subsets[sub_id]['idx']
 
-        correlations = api_utils.calculate_correlation(df[all_subsets], x, y)
+        column_cache = self.new_column_cache(df, subsets)
+        correlations = api_utils.calculate_correlation(column_cache.gather([x, y], all_subsets), x, y, cancel_token=args.get('cancel_token'))
         jsonResult = json.dumps(correlations)
         return jsonResult, 200, {
             'Content-Type': 'application/json; charset=utf-8'
@@ -358,17 +988,16 @@ class SessionWorker(mp.Process):
         plot_supports_hovering = False
         longest_col_name_len = 0
 
-        if self.future_plot_in_requests(args):
-            print('Plot preempted!')
-            return json.dumps(
-                {'preempt': 'Plot preempted by another request.'})
-
         df, subsets, subset_counter, math_vars, col_labels = self.get_data()
         if df is None:
             return json.dumps({'error': api_utils.data_not_loaded_str})
 
         current_user_email = args['current_user_email']
         data = args['data']
+        cancel_token = args.get('cancel_token')
+        column_cache = args.get('column_cache')
+        if column_cache is None:
+            column_cache = self.new_column_cache(df, subsets)
 
         print('Plot generation for ' + current_user_email + '...')
 
@@ -455,7 +1084,9 @@ class SessionWorker(mp.Process):
             # Make a histogram!
             fig, minmax = api_utils.generate_histogram(df, idxs, fig, x,
                                                        data['nbins'],
-                                                       hist_type)
+                                                       hist_type,
+                                                       cancel_token=cancel_token,
+                                                       column_cache=column_cache)
             plot_type = 'histogram'
 
             if hist_type == 'count':
@@ -470,7 +1101,7 @@ class SessionWorker(mp.Process):
 
             fig, minmax, num_nan, is_heatmap, plot_supports_hovering, longest_col_name_len = api_utils.generate_scatter(
                 df2, api_utils.rank_col_name, y, z, idxs, fig, use_bbox, xmin_margin, xmax_margin,
-                ymin_margin, ymax_margin, xlog, ylog, hoverlist=hoverlist)
+                ymin_margin, ymax_margin, xlog, ylog, hoverlist=hoverlist, cancel_token=cancel_token)
             x = 'Rank'
 
         elif x is None or y is None:
@@ -484,12 +1115,11 @@ class SessionWorker(mp.Process):
             minmax = [(-1, 5), (-1, 5)]
         else:
             min_valid_percent = 1
-            for this_idx in idxs:
-                print(df[this_idx][x])
+            for this_idx in ([] if column_cache.all_finite((x, y)) else idxs):
+                api_utils.check_cancelled(cancel_token)
                 min_valid_percent = min(
                     min_valid_percent,
-                    np.sum((np.isfinite(df[this_idx][x]))
-                           & (np.isfinite(df[this_idx][y]))) /
+                    np.sum(column_cache.finite((x, y)) & this_idx) /
                     np.sum(this_idx))
 
             if nans_request == 'hide' or (
@@ -509,7 +1139,9 @@ class SessionWorker(mp.Process):
                     ymax_margin,
                     xlog,
                     ylog,
-                    hoverlist=hoverlist)
+                    hoverlist=hoverlist,
+                    cancel_token=cancel_token,
+                    column_cache=column_cache)
             else:
                 fig, minmax, both_nan, num_nan, is_heatmap, plot_supports_hovering, longest_col_name_len = api_utils.generate_scatter_and_nans(
                     df,
@@ -525,7 +1157,9 @@ class SessionWorker(mp.Process):
                     ymax_margin,
                     xlog,
                     ylog,
-                    hoverlist=hoverlist)
+                    hoverlist=hoverlist,
+                    cancel_token=cancel_token,
+                    column_cache=column_cache)
                 showing_nan_plots = True
                 fig.update_layout(bargap=0.0)
 
@@ -574,6 +1208,8 @@ class SessionWorker(mp.Process):
                 }
             }
         metadata['plot_supports_hovering'] = plot_supports_hovering
+        # Readers hold data_rw_lock, so this is the snapshot the plot was made from.
+        metadata['partial'] = self.get_partial()
         subset_export = {}
         for sub_id in subset_ids:
             subset_export[sub_id] = api_utils.export_subset(subsets, sub_id)
@@ -618,6 +1254,37 @@ class SessionWorker(mp.Process):
             'Content-Type': 'application/json; charset=utf-8'
         }
 
+    def plot_batch(self, args):
+        """ Makes several plots in one request, sharing column values, finite masks and subset unions
+            between them.  Yields one line of JSON per plot as it finishes:
+                {"index": <position in the request>, "result": <what plot_json returns>} """
+        df, subsets, subset_counter, math_vars, col_labels = self.get_data()
+        if df is None:
+            yield json.dumps({'error': api_utils.data_not_loaded_str}) + '\n'
+            return
+
+        plots = args['data']['plots']
+        column_cache = self.new_column_cache(df, subsets)
+        for i, plot_data in enumerate(plots):
+            api_utils.check_cancelled(args.get('cancel_token'))
+            try:
+                result = self.plot_json({
+                    'current_user_email': args['current_user_email'],
+                    'data': plot_data,
+                    'cancel_token': args.get('cancel_token'),
+                    'column_cache': column_cache,
+                })
+            except api_utils.RequestCancelled:
+                raise
+            except Exception as e:
+                tb = traceback.format_exc()
+                print(str(tb))
+                result = json.dumps(dict(error=str(e) + '\n\n' + str(tb)))
+
+            if isinstance(result, tuple):
+                result = result[0]
+            yield '{"index": ' + str(i) + ', "result": ' + result + '}\n'
+
     def select_data(self, args):
         df, subsets, subset_counter, math_vars, col_labels = self.get_data()
         if df is None:
@@ -652,6 +1319,10 @@ class SessionWorker(mp.Process):
             colx = api_utils.rank_col_name
         else:
             df2 = df
+        if df2 is df:
+            column_cache = self.new_column_cache(df, subsets)
+        else:
+            column_cache = api_utils.ColumnCache(df2)
 
         in_any_poly = pd.Series(np.zeros(len(df2), dtype=bool))
 
@@ -676,6 +1347,9 @@ class SessionWorker(mp.Process):
 
                 in_any_poly = (in_any_poly | in_poly)
 
+            if nan_selection is not None or include_both_nans:
+                partitions = column_cache.nan_partitions(colx, coly, slice(None))
+
             if nan_selection is not None:
                 # Add indicies that are selected from the NaN graphs
                 top_xmin = nan_selection[0]
@@ -683,16 +1357,16 @@ class SessionWorker(mp.Process):
                 right_ymin = nan_selection[2]
                 right_ymax = nan_selection[3]
 
-                idx = np.isfinite(df2[colx]) & ~np.isfinite(df2[coly]) & (
+                idx = partitions['null_y'] & (
                     df2[colx] > top_xmin) & (df2[colx] < top_xmax)
                 in_any_poly = (in_any_poly | idx)
 
-                idx = np.isfinite(df2[coly]) & ~np.isfinite(df2[colx]) & (
+                idx = partitions['null_x'] & (
                     df2[coly] > right_ymin) & (df2[coly] < right_ymax)
                 in_any_poly = (in_any_poly | idx)
 
             if include_both_nans:
-                idx = ~np.isfinite(df2[colx]) & ~np.isfinite(df2[coly])
+                idx = partitions['null_both']
                 in_any_poly = (in_any_poly | idx)
 
         if colz is not None and len(colz) > 0 and color_slider_values is not None and len(color_slider_values) == 2 and color_slider_values[0] is not None and color_slider_values[1] is not None:
@@ -700,7 +1374,7 @@ class SessionWorker(mp.Process):
             maxval = max(color_slider_values[0], color_slider_values[1])
             print(f'min {np.min(df2[colz])} max {np.max(df2[colz])}')
             print(f'before {np.sum(in_any_poly)}')
-            in_any_poly = in_any_poly & (df2[colz] >= minval) & (df2[colz] <= maxval)
+            in_any_poly = pd.Series(column_cache.in_ranges(in_any_poly, [(colz, minval, maxval)]))
             print(f'after {np.sum(in_any_poly)}')
 
         # Create a new column index with only these data.
@@ -793,6 +1467,10 @@ class SessionWorker(mp.Process):
             self.data['df'] = df
             self.data['math_vars'] = math_vars
 
+        column_stats = self.get_column_stats()
+        if column_stats is not None:
+            column_stats.add(name_expression, df[name_expression])
+
         # Update the math database
         # Each variable is a json
         new_math_var_str = json.dumps(math_vars)
@@ -850,7 +1528,7 @@ class SessionWorker(mp.Process):
                 output.append(col)
 
         if jupyter_filename is None or not plotplot_config.get_boolean_with_default('jupyter notebook export', 'jupyter_notebook_export_enabled', False):
-            csv = df[subsets[subset_id]['idx']][output].to_csv(index=False)
+            csv = api_utils.ColumnCache(df).gather(output, subsets[subset_id]['idx']).to_csv(index=False)
             file_id = str(uuid.uuid4())
             self.pending_download_files[file_id] = csv
             return json.dumps({'file_id': file_id})
@@ -877,7 +1555,7 @@ class SessionWorker(mp.Process):
                 df_out = df.assign(**new_cols)
 
             # write the file to the path
-            df_out[subsets[subset_id]['idx']][output].to_csv(jupyter_filepath, index=False)
+            api_utils.ColumnCache(df_out).gather(output, subsets[subset_id]['idx']).to_csv(jupyter_filepath, index=False)
             return json.dumps({'file_written': jupyter_filepath})
 
     def download_file(self, args):
@@ -932,18 +1610,20 @@ class SessionWorker(mp.Process):
             return json.dumps({'error': 'too many filters'})
 
         idx = subsets[subset_id]['idx']
+        filter_values = api_utils.ColumnCache(df).gather_column(filter_var, idx).astype(str)
 
         filter_results = []
         filter_idxs = []
 
         for filt in filters:
+            api_utils.check_cancelled(args.get('cancel_token'))
             f = filt['filter']
             key = filt['key']
             if f == '':
                 filter_results.append({'filter': f, 'rows': None, 'key': key})
                 continue
             if exact_match:
-                f_idx = df[idx][filter_var].astype(str).str.upper() == f.upper()
+                f_idx = filter_values.str.upper() == f.upper()
             else:
                 # Use a simplified regex language.
                 # * ---> .* "match anything"
@@ -951,14 +1631,14 @@ class SessionWorker(mp.Process):
                 # [abc] ---> no change
                 reg = api_utils.translate_filter_to_regex(f)
                 if use_contains:
-                    f_idx = df[idx][filter_var].astype(str).str.contains(reg,
-                                                            na=False,
-                                                            regex=True,
-                                                            case=False)
+                    f_idx = filter_values.str.contains(reg,
+                                                       na=False,
+                                                       regex=True,
+                                                       case=False)
                 else:
-                    f_idx = df[idx][filter_var].astype(str).str.fullmatch(reg,
-                                                              na=False,
-                                                              case=False)
+                    f_idx = filter_values.str.fullmatch(reg,
+                                                        na=False,
+                                                        case=False)
             filter_results.append({
                 'filter': f,
                 'rows': int(np.sum(f_idx)),
@@ -1041,7 +1721,8 @@ class SessionWorker(mp.Process):
 
 
         # Apply the function to each row of the DataFrame
-        levenshtein_dist_out = df[idx][filter_var].apply(levenshtein_dist, target=levenshtein_seq)
+        levenshtein_dist_out = api_utils.apply_in_chunks(api_utils.ColumnCache(df).gather_column(filter_var, idx), levenshtein_dist,
+                                                         args.get('cancel_token'), target=levenshtein_seq)
 
         out = {}
         out_to_json = {}
@@ -1141,6 +1822,7 @@ class SessionWorker(mp.Process):
 
         organize_bulk_array = []
         db_inserts = []
+        new_subsets = []
 
         if len(bulk_import_df['subset_name'].unique()) < 1:
             return json.dumps({'error': 'No rows supplied.'})
@@ -1153,6 +1835,7 @@ class SessionWorker(mp.Process):
             found_valid_row = False
             subset_idx = np.zeros(len(df), dtype=bool)
             for search_str in bulk_import_df[bulk_import_df['subset_name'].astype(str) == subset_name]['filter_string']:
+                api_utils.check_cancelled(args.get('cancel_token'))
                 search_str = str(search_str)
                 print('search_str', search_str)
                 reg = api_utils.translate_filter_to_regex(search_str)
@@ -1175,10 +1858,6 @@ class SessionWorker(mp.Process):
             # Restrict to selected subset.
             subset_idx &= subsets[subset_id]['idx']
 
-            subset_counter, db_insert, count = self.add_subset(subset_idx, subset_counter)
-            
-            db_inserts.append(db_insert)
-
             subset_color_array = bulk_import_df[bulk_import_df['subset_name'] == subset_name][['color']].dropna()
 
             if subset_color_array.empty:
@@ -1196,6 +1875,15 @@ class SessionWorker(mp.Process):
                 except ValueError as e:
                     return json.dumps({'error': 'Subset "' + subset_name + '" has size set to "' + subset_size_array.iat[-1,0] + '" which is not an integer.'})
 
+            new_subsets.append((subset_name, subset_idx, subset_size, subset_color))
+
+        # Only add subsets once every row has matched, so an error or a cancellation part way through
+        # doesn't leave some of them behind.
+        for subset_name, subset_idx, subset_size, subset_color in new_subsets:
+            subset_counter, db_insert, count = self.add_subset(subset_idx, subset_counter)
+            
+            db_inserts.append(db_insert)
+
             organize_bulk_array.append({
                 'name': subset_name,
                 'count': count,
@@ -1237,7 +1925,7 @@ class SessionWorker(mp.Process):
         # Need to do astype(str) otherwise you can have integer or float values that match
         # other string values.  They will appear different here and then end up the same thing
         # when casted to a string later.
-        value_counts = df[idx][filter_var].astype(str).value_counts()
+        value_counts = api_utils.ColumnCache(df).gather_column(filter_var, idx).astype(str).value_counts()
         num_unique = len(value_counts)
         if num_unique > 100:
             return json.dumps({'num_unique': num_unique})
@@ -0,0 +1,106 @@
+from multiprocessing import shared_memory, resource_tracker
+from flask import Response
+
+# Results smaller than this go through the session's output queue as-is.  Larger ones (plot JSON for big
+# sessions, CSV downloads) are written once into a shared memory segment and only a handle is queued.
+min_shared_payload_bytes = 1024 * 1024
+
+# How much of the segment to hand to the web server at a time.
+stream_chunk_bytes = 1024 * 1024
+
+
+class SharedPayload():
+    """ Handle to a result body sitting in a shared memory segment. """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+class SharedPayloadStream():
+    """ Iterates over a shared memory segment in chunks for a streaming HTTP response.
+
+        The web server calls close() when it is done with the response (even if the client went away
+        before the body was sent), which is when the segment is unlinked."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.shm = shared_memory.SharedMemory(name=payload.name)
+
+    def __iter__(self):
+        for start in range(0, self.payload.size, stream_chunk_bytes):
+            end = min(start + stream_chunk_bytes, self.payload.size)
+            yield self.shm.buf[start:end].tobytes()
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+
+def pack(result):
+    """ Called in the worker process.  Moves a large string result (or the body of a
+        (body, status, headers) tuple) into shared memory and returns a SharedPayload in its place.
+        Anything else is returned unchanged. """
+    if isinstance(result, tuple) and len(result) > 0 and isinstance(result[0], str):
+        return (pack(result[0]), ) + result[1:]
+
+    if not isinstance(result, str) or len(result) < min_shared_payload_bytes:
+        return result
+
+    data = result.encode('utf-8')
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    payload = SharedPayload(shm.name, len(data))
+    shm.close()
+
+    # The Flask process unlinks the segment after it has been sent.  Stop this process's resource
+    # tracker from also trying to clean it up when the worker exits.
+    resource_tracker.unregister(shm._name, 'shared_memory')
+
+    return payload
+
+
+def unpack(result):
+    """ Called in the Flask process.  Turns a SharedPayload (alone or as the body of a
+        (body, status, headers) tuple) into a response that streams straight out of shared memory. """
+    if isinstance(result, tuple) and len(result) > 0 and isinstance(result[0], SharedPayload):
+        return (unpack(result[0]), ) + result[1:]
+
+    if not isinstance(result, SharedPayload):
+        return result
+
+    response = Response(SharedPayloadStream(result), direct_passthrough=True)
+    response.headers['Content-Length'] = str(result.size)
+    return response
+
+
+def iterate(result):
+    """ Called in the Flask process.  Yields a piece of a streamed result, reading it out of shared
+        memory (and unlinking the segment) if it was moved there. """
+    if not isinstance(result, SharedPayload):
+        yield result
+        return
+
+    stream = SharedPayloadStream(result)
+    try:
+        yield from stream
+    finally:
+        stream.close()
+
+
+def discard(result):
+    """ Called in the Flask process for a result nobody will read.  Unlinks its shared memory segment
+        if it has one. """
+    if isinstance(result, tuple) and len(result) > 0:
+        result = result[0]
+    if not isinstance(result, SharedPayload):
+        return
+    try:
+        shm = shared_memory.SharedMemory(name=result.name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,76 @@
+import threading
+import multiprocessing as mp
+from .session_worker import SessionWorker, SessionAdoption
+from . import plotplot_config
+
+# Created on first use so the config file is read after the server has set it up.
+g_worker_pool = None
+g_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    global g_worker_pool
+    with g_worker_pool_lock:
+        if g_worker_pool is None:
+            g_worker_pool = WorkerPool(max(0, plotplot_config.get_int_with_default('performance', 'worker_pool_size', 1)))
+        return g_worker_pool
+
+
+class WorkerPool():
+    """ Keeps a few session workers started and warmed up (imports loaded, JIT kernels compiled) so a
+        new upload or resume can hand its session to one straight away instead of paying for that on
+        the first plot. """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def fill(self):
+        """ Starts idle workers until the pool is full. """
+        with self.lock:
+            self.idle = [w for w in self.idle if w['process'].is_alive()]
+            while len(self.idle) < self.size:
+                self.idle.append(self.start_worker(None, None, None, None, None, pooled=True))
+
+    def take(self, id, path, gdrive_file_info, subsets_from_db, math_vars, follow=False):
+        """ Returns a running worker for this session, from the pool if there is one ready. """
+        with self.lock:
+            pooled = None
+            while len(self.idle) > 0 and pooled is None:
+                w = self.idle.pop(0)
+                if w['process'].is_alive():
+                    pooled = w
+
+        if pooled is None:
+            worker_data = self.start_worker(id, path, gdrive_file_info, subsets_from_db, math_vars, follow=follow)
+        else:
+            pooled['adopt'].put(SessionAdoption(id, path, gdrive_file_info, subsets_from_db, math_vars, follow))
+            worker_data = pooled
+
+        if self.size > 0:
+            # Replace the worker we just used off the request thread.
+            threading.Thread(target=self.fill, daemon=True).start()
+
+        return worker_data
+
+    def start_worker(self, id, path, gdrive_file_info, subsets_from_db, math_vars, pooled=False, follow=False):
+        input_queue = mp.Queue()
+        output_queue = mp.Queue()
+        shutdown_queue = mp.Queue()
+        adopt_queue = mp.Queue() if pooled else None
+
+        worker = SessionWorker(id, path, gdrive_file_info, input_queue, output_queue, shutdown_queue,
+                               subsets_from_db, math_vars, adopt_queue=adopt_queue, follow=follow)
+        # Pooled or not, a worker shouldn't keep the server from exiting: its session can't be reached
+        # once the server is gone.
+        worker.daemon = True
+        worker.start()
+
+        return {
+            'process': worker,
+            'input': input_queue,
+            'output': output_queue,
+            'shutdown': shutdown_queue,
+            'adopt': adopt_queue,
+        }
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Keep the configuration, caches and database out of the real home directory.  Set before plotplot is
+# imported, it reads them on import.
+test_home = tempfile.mkdtemp(prefix='plotplot_test_')
+os.environ['PLOTPLOT_CONFIG_PATH'] = os.path.join(test_home, 'plotplot.ini')
+os.environ['XDG_CACHE_HOME'] = os.path.join(test_home, 'cache')
+os.environ['XDG_DATA_HOME'] = os.path.join(test_home, 'data')
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from plotplot import worker_pool
+from plotplot.globals import g_processes
+from plotplot.load_and_resume import load_data
+from plotplot.session_worker import call_worker
+
+num_columns = 20
+num_rows = 1000
+
+
+@pytest.fixture(scope='module')
+def data_id():
+    # Column c<k> holds k * 1000 + row, so a column's minimum says which column a reply is for.
+    path = os.path.join(test_home, 'interleaved.csv')
+    rows = np.arange(num_rows)
+    df = pd.DataFrame({f'c{k}': k * 1000 + rows for k in range(num_columns)})
+    df['s'] = [f'name{i % 7}' for i in rows]
+    df.to_csv(path, index=False)
+
+    # A worker of its own rather than one from the pool.
+    worker_pool.get_worker_pool().size = 0
+    data_id = load_data(path)
+
+    deadline = time.time() + 60
+    while True:
+        progress = json.loads(g_processes[data_id]['progress'].get('loading'))
+        assert 'error' not in progress, progress
+        if progress.get('done'):
+            break
+        assert time.time() < deadline, 'Timed out loading the test file.'
+        time.sleep(0.05)
+
+    yield data_id
+
+    # The worker would otherwise wait for requests until its idle timeout.
+    process = g_processes[data_id]['process']
+    process.terminate()
+    process.join()
+    shutil.rmtree(test_home, ignore_errors=True)
+
+
+def test_interleaved_requests_get_their_own_replies(data_id):
+    """ Hundreds of requests in flight at once, of kinds that take different paths through the worker
+        (the fast lane, plots), must each get the reply to their own request. """
+    requests = []
+    for i in range(300):
+        k = i % num_columns
+        if i % 10 == 3:
+            requests.append(('get_columns', {}, None))
+        elif i % 10 == 7:
+            requests.append(('get_subsets', {}, None))
+        else:
+            # A key of its own, so no plot replaces another.
+            plot = {
+                'key': f'plot{i}',
+                'x': f'c{k}',
+                'y': f'c{(k + 1) % num_columns}',
+                'z': None,
+                'plot_type': 'scatter',
+                'subsets': [0],
+                'hoverlist': [],
+                'nans_request': 'auto',
+                'nbins': 50,
+                'hist_type': 'count',
+            }
+            requests.append(('plot_json', {'current_user_email': 'test', 'data': plot}, k))
+
+    def send(request):
+        function_name, args, k = request
+        reply = call_worker(data_id, function_name, args)
+        if isinstance(reply, tuple):
+            # (body, status, headers), as plot_json returns.
+            reply = reply[0]
+        if not isinstance(reply, str):
+            # A large reply, streamed out of shared memory.
+            reply = reply.get_data(as_text=True)
+        return reply
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        replies = list(executor.map(send, requests))
+
+    for (function_name, args, k), reply in zip(requests, replies):
+        reply = json.loads(reply)
+        assert 'error' not in reply and 'preempt' not in reply, reply
+        if function_name == 'plot_json':
+            minmax = reply[1]['minmax']
+            assert minmax['xmin'] == k * 1000
+            assert minmax['xmax'] == k * 1000 + num_rows - 1
+            assert minmax['ymin'] == (k + 1) % num_columns * 1000
+        elif function_name == 'get_columns':
+            assert set(reply['numeric']) == {f'c{k}' for k in range(num_columns)}
+            assert reply['non_numeric'] == ['s']
+        else:
+            assert reply['0']['count'] == num_rows